@@ -0,0 +1,192 @@
+"""
+Summarises where agents die, stall and spend their time from a TraceArchive, the per step records written by runs with MARIO_TRACE_ARCHIVE set.
+
+    MARIO_TRACE_ARCHIVE=../results/archive python3 run.py --upi your_upi
+    python3 analyze_traces.py ../results/archive
+    python3 analyze_traces.py ../results/archive --runs upi_one upi_two --output analysis
+
+Columns are absolute tile columns (absolute x / 8) grouped into bins of --bin columns.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from mario_expert import LINK, TraceArchive
+
+logging.basicConfig(level=logging.INFO)
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("archive", type=str)
+    parse_args.add_argument("--runs", type=str, nargs="*", default=None, help="only these run names")
+    parse_args.add_argument("--bin", type=int, default=8, help="columns per heatmap bin")
+    parse_args.add_argument("--top", type=int, default=10, help="rows shown in the printed tables")
+    parse_args.add_argument("--output", type=str, default=None, help="directory to write the heatmaps and profiles to")
+
+    return parse_args.parse_args()
+
+
+def load(path, runs=None):
+    columns = TraceArchive.load(path)
+    if runs is not None:
+        names = TraceArchive.runs(path)
+        indices = [i for i, name in enumerate(names) if name in runs]
+        keep = np.isin(columns["run"], indices)
+        columns = {column: values[keep] for column, values in columns.items()}
+    return columns
+
+
+def events(columns):
+    """Returns boolean arrays marking the steps mario died during and the steps he made no progress in"""
+    run = columns["run"]
+    lives = columns["lives"].astype(np.int16)
+    x_position = columns["x_position"].astype(np.int32)
+    stage = columns["world"].astype(np.int16) * 16 + columns["stage"]
+
+    #each step is compared with the one before it in the same run and stage
+    same = np.zeros(len(run), dtype=bool)
+    same[1:] = (run[1:] == run[:-1]) & (stage[1:] == stage[:-1])
+    died = np.zeros(len(run), dtype=bool)
+    died[1:] = (run[1:] == run[:-1]) & (lives[1:] < lives[:-1])
+    stalled = np.zeros(len(run), dtype=bool)
+    stalled[1:] = same[1:] & (x_position[1:] <= x_position[:-1])
+    return died, stalled & ~died
+
+
+def heatmaps(columns, masks, bin_size):
+    """Counts each mask by (stage, column bin), returns the stage labels and a (stages, bins) array per mask"""
+    keys = columns["world"].astype(np.int32) * 16 + columns["stage"]
+    stages, stage_index = np.unique(keys, return_inverse=True)
+    bins = np.maximum(columns["col"].astype(np.int32), 0) // bin_size
+    width = int(bins.max()) + 1 if len(bins) else 1
+    flat = stage_index * width + bins
+
+    labels = [f"{key // 16}-{key % 16}" for key in stages]
+    maps = {}
+    for name, mask in masks.items():
+        maps[name] = np.bincount(flat[mask], minlength=len(stages) * width).reshape(len(stages), width)
+    return labels, maps
+
+
+def link_success(columns, died):
+    """
+    Per link type what its attempts achieved, an attempt being consecutive steps running the same edge.
+
+    The planners replan every step and the greedy one picks a fresh target on most of them, so an edge is rarely run to its finish node.
+    An attempt is judged by where mario is when the next one starts instead: progressed if he is further right and didn't die,
+    reached if he got at least as far as the target column (in the direction of the target) and didn't die, and gain is the mean columns moved by the attempts he survived.
+    The last attempt of each run has nothing after it and is left out.
+    """
+    run = columns["run"]
+    link = columns["link"]
+    col = columns["col"].astype(np.int32)
+    target_col = columns["target_col"].astype(np.int32)
+    target_row = columns["target_row"]
+
+    start = np.ones(len(run), dtype=bool)
+    start[1:] = (run[1:] != run[:-1]) | (link[1:] != link[:-1]) | (target_col[1:] != target_col[:-1]) | (target_row[1:] != target_row[:-1])
+    starts = np.flatnonzero(start)
+    if len(starts) < 2:
+        return {}
+
+    first, following = starts[:-1], starts[1:]
+    deaths = np.add.reduceat(died.astype(np.int32), starts)[:-1] > 0
+    known = (run[first] == run[following]) & (link[first] != -1)
+    gain = col[following] - col[first]
+    wanted = target_col[first] - col[first]
+    progressed = (gain > 0) & ~deaths
+    reached = (gain * np.sign(wanted) >= np.abs(wanted)) & ~deaths
+
+    results = {}
+    for link_type in LINK:
+        attempts = known & (link[first] == link_type.value)
+        count = int(attempts.sum())
+        results[link_type.name] = {
+            "attempts": count,
+            "progressed": int((attempts & progressed).sum()),
+            "reached": int((attempts & reached).sum()),
+            "deaths": int((attempts & deaths).sum()),
+            "gain": float(gain[attempts & ~deaths].mean()) if (attempts & ~deaths).any() else 0.0,
+        }
+    return results
+
+
+def column_profile(columns, bin_size):
+    """Per column bin (steps, planner seconds, step seconds)"""
+    bins = np.maximum(columns["col"].astype(np.int32), 0) // bin_size
+    steps = np.bincount(bins)
+    plan = np.bincount(bins, weights=columns["plan_us"]) / 1e6
+    step = np.bincount(bins, weights=columns["step_us"]) / 1e6
+    return steps, plan, step
+
+
+def save_heatmap(path, labels, heatmap, bin_size):
+    header = "stage," + ",".join(str(i * bin_size) for i in range(heatmap.shape[1]))
+    rows = [f"{label}," + ",".join(str(value) for value in row) for label, row in zip(labels, heatmap)]
+    with open(f"{path}.csv", "w", encoding="utf-8") as file:
+        file.write("\n".join([header] + rows) + "\n")
+
+    import cv2
+    scaled = (255 * heatmap / max(heatmap.max(), 1)).astype(np.uint8)
+    image = cv2.applyColorMap(scaled, cv2.COLORMAP_INFERNO)
+    image = cv2.resize(image, (heatmap.shape[1] * 8, heatmap.shape[0] * 24), interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(f"{path}.png", image)
+
+
+def main():
+    args = get_args()
+
+    start = time.perf_counter()
+    columns = load(args.archive, args.runs)
+    steps = len(columns["run"])
+    if steps == 0:
+        logging.warning(f"No records in {args.archive}")
+        return
+
+    died, stalled = events(columns)
+    labels, maps = heatmaps(columns, {"deaths": died, "stalls": stalled}, args.bin)
+    links = link_success(columns, died)
+    column_steps, plan, step = column_profile(columns, args.bin)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Analysed {steps} steps from {len(np.unique(columns['run']))} runs in {elapsed:.2f} s")
+
+    for name, heatmap in maps.items():
+        print(f"\nMost {name} (stage, columns, count)")
+        flat = np.argsort(heatmap, axis=None)[::-1][: args.top]
+        for stage, column in zip(*np.unravel_index(flat, heatmap.shape)):
+            if heatmap[stage, column] == 0:
+                break
+            print(f"  {labels[stage]:>5} {column * args.bin:>5}-{(column + 1) * args.bin - 1:<5} {heatmap[stage, column]}")
+
+    print("\nLink success (attempts, progressed, reached target column, deaths, mean columns gained)")
+    for name, link in links.items():
+        attempts = max(link["attempts"], 1)
+        print(
+            f"  {name:>10} {link['attempts']:>8} {link['progressed'] / attempts:>7.1%} {link['reached'] / attempts:>7.1%} {link['deaths']:>6} {link['gain']:>6.2f}"
+        )
+
+    print("\nMost time per column (columns, steps, planner s, step s, mean step ms)")
+    for column in np.argsort(step)[::-1][: args.top]:
+        if column_steps[column] == 0:
+            break
+        print(
+            f"  {column * args.bin:>5}-{(column + 1) * args.bin - 1:<5} {column_steps[column]:>8} {plan[column]:>9.2f} {step[column]:>9.2f} {step[column] / column_steps[column] * 1000:>8.2f}"
+        )
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+        for name, heatmap in maps.items():
+            save_heatmap(f"{args.output}/{name}", labels, heatmap, args.bin)
+        profile = np.column_stack([np.arange(len(step)) * args.bin, column_steps, plan, step])
+        np.savetxt(f"{args.output}/column_time.csv", profile, delimiter=",", header="column,steps,plan_s,step_s", comments="", fmt=["%d", "%d", "%.6f", "%.6f"])
+        logging.info(f"Saved heatmaps and the column profile to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Micro benchmarks for the parts of the Mario Expert agent that run every step.
+
+    python3 benchmark.py executor
+    python3 benchmark.py frame
+    python3 benchmark.py startup
+    python3 benchmark.py incremental --trace areas.npz
+    python3 benchmark.py batch --envs 8
+    python3 benchmark.py schedule --episodes 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from mario_expert import (
+    LINK,
+    MASK_BUTTONS,
+    AnytimePlanner,
+    BatchGraph,
+    Edge,
+    IncrementalPlanner,
+    MarioController,
+    MarioExpert,
+    RuleProbe,
+    build_decision_table,
+    decision_index,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+#run in a fresh interpreter for every sample so nothing is already imported
+STARTUP_SCRIPT = """
+import json, sys, tempfile, time
+start = time.perf_counter()
+import mario_expert
+result = {
+    "import_ms": (time.perf_counter() - start) * 1000,
+    "modules": len(sys.modules),
+    "cv2_loaded": not isinstance(sys.modules.get("cv2", mario_expert.cv2), mario_expert.LazyModule),
+}
+if STEP:
+    expert = mario_expert.MarioExpert(results_path=tempfile.mkdtemp(), headless=True)
+    expert.environment.reset()
+    expert.step()
+    result["first_step_ms"] = (time.perf_counter() - start) * 1000
+print(json.dumps(result))
+"""
+
+
+def random_situations(count, seed=0):
+    """Returns executor inputs spread over the whole game area, a fifth of them with no enemy"""
+    rng = random.Random(seed)
+    situations = []
+    for _ in range(count):
+        row, col = rng.randint(3, 15), rng.randint(0, 19)
+        edge = Edge(rng.randint(3, 15), rng.randint(0, 19), rng.choice(list(LINK)))
+        if rng.random() < 0.2:
+            enemy_row, enemy_col = -1, -1
+        else:
+            enemy_row, enemy_col = rng.randint(0, 15), rng.randint(0, 19)
+        situations.append((row, col, edge, enemy_row, enemy_col, rng.randint(0, 1), rng.randint(0, 2)))
+    return situations
+
+
+def run_rules(situations):
+    for row, col, edge, enemy_row, enemy_col, on_ground, jump_phase in situations:
+        probe = RuleProbe(on_ground, jump_phase)
+        if edge.link_type == LINK.WALK:
+            MarioController.walk(probe, col, edge, enemy_col)
+        elif edge.link_type == LINK.FALL:
+            MarioController.fall(probe, row, col, edge, enemy_col)
+        elif edge.link_type == LINK.JUMP:
+            MarioController.jump(probe, row, col, edge, enemy_row, enemy_col)
+        else:
+            MarioController.faith(probe, row, col, edge, enemy_row, enemy_col)
+        probe.send_button([])
+
+
+def run_table(situations, table):
+    for row, col, edge, enemy_row, enemy_col, on_ground, jump_phase in situations:
+        probe = RuleProbe(on_ground, jump_phase)
+        index = decision_index(row, col, edge, enemy_row, enemy_col, probe._read_m(0xC20A), probe._read_m(0xC207))
+        probe.send_button(MASK_BUTTONS[table[index]])
+
+
+def per_step_us(function, steps, *args):
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+def benchmark_executor(args):
+    start = time.perf_counter()
+    table = build_decision_table()
+    logging.info(f"Built decision table {table.shape} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    table = table.tobytes()
+
+    situations = random_situations(args.steps)
+    rules = per_step_us(run_rules, args.steps, situations)
+    lookup = per_step_us(run_table, args.steps, situations, table)
+
+    logging.info(f"Rules: {rules:.2f} us/step")
+    logging.info(f"Table: {lookup:.2f} us/step")
+    logging.info(f"Speedup: {rules / lookup:.2f}x")
+
+
+def benchmark_frame(args):
+    environment = MarioController(headless=True)
+    environment.reset()
+    environment.tick(args.warmup)
+
+    buffers = {
+        "native bgr": np.empty((144, 160, 3), dtype=np.uint8),
+        "native gray": np.empty((144, 160), dtype=np.uint8),
+        "half gray": np.empty((72, 80), dtype=np.uint8),
+        "300x240 bgr": np.empty((240, 300, 3), dtype=np.uint8),
+    }
+
+    def run_grab_frame():
+        for _ in range(args.steps):
+            environment.grab_frame()
+
+    def run_view():
+        for _ in range(args.steps):
+            environment.frame_view()
+
+    def run_into(out):
+        for _ in range(args.steps):
+            environment.grab_frame_into(out)
+
+    baseline = per_step_us(run_grab_frame, args.steps)
+    logging.info(f"grab_frame: {baseline:.2f} us/frame")
+    logging.info(f"frame_view: {per_step_us(run_view, args.steps):.2f} us/frame")
+    for name, out in buffers.items():
+        cost = per_step_us(run_into, args.steps, out)
+        logging.info(f"grab_frame_into {name}: {cost:.2f} us/frame ({baseline / cost:.2f}x)")
+
+    difference = np.abs(environment.grab_frame().astype(np.int16) - environment.grab_frame_into(buffers["300x240 bgr"])).max()
+    logging.info(f"Largest pixel difference between grab_frame and grab_frame_into at 300x240: {difference}")
+
+
+def benchmark_startup(args):
+    script = STARTUP_SCRIPT.replace("STEP", str(not args.import_only))
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", script], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    for key in ["import_ms", "first_step_ms"]:
+        if key in samples[0]:
+            values = [sample[key] for sample in samples]
+            logging.info(f"{key}: median {statistics.median(values):.1f} min {min(values):.1f} max {max(values):.1f}")
+    logging.info(f"Modules loaded by the import: {samples[0]['modules']}")
+    logging.info(f"OpenCV loaded: {samples[0]['cv2_loaded']}")
+
+
+def synthetic_trace(steps, seed=0):
+    """Returns (game areas, origins) of mario walking through a random level with gaps, pipes and walking enemies"""
+    rng = np.random.default_rng(seed)
+    width = steps // 3 + 40
+    level = np.zeros((16, width), dtype=np.uint8)
+    level[14:, :] = 10
+    for col in range(25, width - 20, 15):
+        kind = rng.integers(3)
+        if kind == 0:
+            level[14:, col:col + 2] = 0
+        elif kind == 1:
+            level[12:14, col:col + 2] = 14
+        else:
+            level[9, col:col + 4] = 10
+    enemies = [[float(col), -1.0] for col in rng.integers(20, width - 5, size=width // 12)]
+
+    areas = []
+    origins = []
+    for step in range(steps):
+        origin = min(step // 3, width - 20)
+        area = level[:, origin:origin + 20].copy()
+        for enemy in enemies:
+            col = int(enemy[0])
+            ahead = int(enemy[0] + enemy[1])
+            if ahead <= 0 or ahead >= width or level[13, ahead] != 0 or level[14, ahead] == 0:
+                enemy[1] = -enemy[1]
+            enemy[0] += enemy[1] * 0.25
+            if origin <= col < origin + 20:
+                area[13, col - origin] = 15
+        area[12:14, 4:6] = 1
+        areas.append(area)
+        origins.append(origin)
+    return np.array(areas), np.array(origins)
+
+
+def benchmark_incremental(args):
+    if args.trace is not None:
+        with np.load(args.trace) as data:
+            areas, origins = data["areas"], data["origins"]
+    else:
+        areas, origins = synthetic_trace(args.steps)
+    logging.info(f"Planning over {len(areas)} game areas")
+
+    expert = MarioExpert.__new__(MarioExpert)
+    expert.init_planning()
+    incremental = IncrementalPlanner()
+    scratch = IncrementalPlanner(incremental=False)
+    uniform = AnytimePlanner(budget_us=10 ** 9)
+
+    planned = 0
+    mismatches = 0
+    cost_mismatches = 0
+    timings = {"incremental": 0.0, "scratch": 0.0}
+    for step, (area, origin) in enumerate(zip(areas, origins)):
+        expert.observe(area)
+        expert.origin = int(origin)
+        expert.generate_graph()
+        target = expert.plan_target()
+        if target is None:
+            continue
+        planned += 1
+
+        routes = {}
+        for name, planner in [("incremental", incremental), ("scratch", scratch)]:
+            start = time.perf_counter()
+            routes[name] = planner.plan(expert.gamegraph, expert.origin, expert.mario_row, expert.mario_col, target, expert.search_cost)
+            timings[name] += time.perf_counter() - start
+        if [(e.finish_row, e.finish_col, e.link_type) for e in routes["incremental"]] != [(e.finish_row, e.finish_col, e.link_type) for e in routes["scratch"]]:
+            mismatches += 1
+
+        #the uniform cost search may break ties differently but must find the same cost
+        route = uniform.plan(expert.gamegraph, expert.mario_row, expert.mario_col, target, expert.search_cost, step)
+        if abs(sum(map(expert.search_cost, route)) - sum(map(expert.search_cost, routes["incremental"]))) > 1e-6:
+            cost_mismatches += 1
+
+    saved = 1 - incremental.expansions / max(scratch.expansions, 1)
+    logging.info(f"From scratch: {scratch.expansions} expansions, {timings['scratch'] / max(planned, 1) * 1e6:.1f} us/plan")
+    logging.info(f"Incremental: {incremental.expansions} expansions, {timings['incremental'] / max(planned, 1) * 1e6:.1f} us/plan")
+    logging.info(f"Expansions saved: {saved * 100:.1f}% over {planned} plans")
+    logging.info(f"Paths different from scratch: {mismatches}, costs different from uniform cost search: {cost_mismatches}")
+
+
+def benchmark_batch(args):
+    #tile worlds stand in for the emulator so this runs without the ROM
+    from tile_world import TileWorld
+
+    os.environ["MARIO_ROUTE_DB"] = ""
+    logging.getLogger().setLevel(logging.WARNING)
+
+    #the game areas the experts saw, stacked across environments step by step
+    environments = [TileWorld(seed=seed) for seed in range(args.envs)]
+    experts = []
+    for environment in environments:
+        environment.reset()
+        experts.append(MarioExpert.from_environment(environment, args.results))
+    areas = []
+    try:
+        for _ in range(args.steps):
+            for expert in experts:
+                if not expert.environment.get_game_over():
+                    expert.step()
+            areas.append(np.stack([expert.gamespace for expert in experts]))
+    finally:
+        for expert in experts:
+            expert.close()
+
+    #the graph and target stage on its own, over the same stacks of game areas
+    expert = MarioExpert.__new__(MarioExpert)
+    expert.init_planning()
+    start = time.perf_counter()
+    targets = []
+    for stack in areas:
+        for area in stack:
+            expert.observe(area)
+            expert.generate_graph()
+            target = expert.plan_target()
+            targets.append(-1 if target is None else target)
+    scalar = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = []
+    for stack in areas:
+        rows, cols = BatchGraph.mario_positions(stack)
+        batched.extend(BatchGraph(stack).targets(rows, cols).tolist())
+    batch = time.perf_counter() - start
+
+    logging.getLogger().setLevel(logging.INFO)
+    logging.info(f"Graph and target per area: {scalar / len(targets) * 1e6:.1f} us one at a time, {batch / len(targets) * 1e6:.1f} us batched over {args.envs} areas")
+    logging.info(f"Targets different: {sum(a != b for a, b in zip(targets, batched))} of {len(targets)}")
+
+
+def benchmark_schedule(args):
+    from tile_world import TileWorld
+
+    os.environ["MARIO_ROUTE_DB"] = ""
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    reasons = {}
+    for schedule in ["fixed", "adaptive"]:
+        os.environ["MARIO_SCHEDULE"] = schedule
+        totals = {"decisions": 0, "planner_cpu_s": 0.0, "frames": 0, "progress": 0, "deaths": 0}
+        histogram = {}
+        for seed in range(args.seed, args.seed + args.episodes):
+            environment = TileWorld(seed=seed)
+            environment.reset()
+            expert = MarioExpert.from_environment(environment, args.results)
+            choose_action = expert.choose_action
+
+            def timed_choose_action():
+                start = time.process_time()
+                try:
+                    return choose_action()
+                finally:
+                    totals["planner_cpu_s"] += time.process_time() - start
+                    totals["decisions"] += 1
+
+            expert.choose_action = timed_choose_action
+            lives = environment.get_lives()
+            furthest = (1, 1, 0)
+            try:
+                while environment.frames < args.frames and not environment.get_game_over():
+                    expert.step()
+                    furthest = max(furthest, (environment.get_world(), environment.get_stage(), environment.get_x_position()))
+                    totals["deaths"] += environment.get_lives() < lives
+                    lives = environment.get_lives()
+            finally:
+                expert.close()
+            #progress in pixels, stages counting as a fixed length
+            totals["progress"] += ((furthest[0] - 1) * 3 + furthest[1] - 1) * args.stage_length + furthest[2]
+            totals["frames"] += environment.frames
+            if expert.scheduler is not None:
+                stats = expert.scheduler.stats()
+                for frames, count in stats["histogram"].items():
+                    histogram[frames] = histogram.get(frames, 0) + count
+                for reason, count in stats["reasons"].items():
+                    reasons[reason] = reasons.get(reason, 0) + count
+        results[schedule] = (totals, histogram)
+    os.environ.pop("MARIO_SCHEDULE")
+
+    logging.getLogger().setLevel(logging.INFO)
+    for schedule, (totals, histogram) in results.items():
+        logging.info(
+            f"{schedule}: {totals['decisions']} decisions, {totals['planner_cpu_s']:.2f} planner cpu s, "
+            f"{totals['frames'] / max(totals['decisions'], 1):.1f} frames/decision, progress {totals['progress'] / args.episodes:.0f} px/episode, deaths {totals['deaths'] / args.episodes:.2f}/episode"
+        )
+    decisions = sum(results["adaptive"][1].values())
+    logging.info("Adaptive frames per decision (frames: share)")
+    for frames, count in sorted(results["adaptive"][1].items()):
+        logging.info(f"  {frames:>3}: {count / max(decisions, 1):6.1%}")
+    logging.info(f"Adaptive decisions by what set their frames: {reasons}")
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+    subparsers = parse_args.add_subparsers(dest="benchmark", required=True)
+
+    executor = subparsers.add_parser("executor", help="decision table executor against the walk/fall/jump/faith rules")
+    executor.add_argument("--steps", type=int, default=200000)
+    executor.set_defaults(function=benchmark_executor)
+
+    frame = subparsers.add_parser("frame", help="grab_frame against frame_view and grab_frame_into with preallocated buffers")
+    frame.add_argument("--steps", type=int, default=5000)
+    frame.add_argument("--warmup", type=int, default=600, help="frames to run first so the screen isn't blank")
+    frame.set_defaults(function=benchmark_frame)
+
+    startup = subparsers.add_parser("startup", help="time to import mario_expert and to finish the first step in a fresh process")
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("--import-only", action="store_true", help="skip the first step, which needs the ROM")
+    startup.set_defaults(function=benchmark_startup)
+
+    incremental = subparsers.add_parser("incremental", help="incremental search against searching from scratch on a game area trace")
+    incremental.add_argument("--trace", type=str, default=None, help="trace written with MARIO_AREA_TRACE, a synthetic level if not given")
+    incremental.add_argument("--steps", type=int, default=3000, help="length of the synthetic trace")
+    incremental.set_defaults(function=benchmark_incremental)
+
+    batch = subparsers.add_parser("batch", help="graph and target one game area at a time against BatchGraph over stacked tile world areas")
+    batch.add_argument("--envs", type=int, default=8, help="areas in each stack")
+    batch.add_argument("--steps", type=int, default=200, help="decisions per environment")
+    batch.add_argument("--results", type=str, default="/tmp")
+    batch.set_defaults(function=benchmark_batch)
+
+    schedule = subparsers.add_parser("schedule", help="adaptive frames per decision against the fixed act_freq in tile worlds")
+    schedule.add_argument("--episodes", type=int, default=20)
+    schedule.add_argument("--frames", type=int, default=3000, help="frame budget for each episode")
+    schedule.add_argument("--seed", type=int, default=0)
+    schedule.add_argument("--stage-length", type=int, default=1600, help="pixels a finished stage counts for in progress")
+    schedule.add_argument("--results", type=str, default="/tmp")
+    schedule.set_defaults(function=benchmark_schedule)
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Fits the JumpArcModel used to prune jump links to kinematic traces recorded from the emulator.
+
+Record traces by running the agent with MARIO_KINEMATICS_TRACE set, e.g.
+
+    MARIO_KINEMATICS_TRACE=trace.npz python3 run.py --upi your_upi
+
+then point the agent at the calibrated model with MARIO_ARC_MODEL=arc_model.json
+"""
+
+import argparse
+import logging
+
+import numpy as np
+
+from mario_expert import JumpArcModel
+
+logging.basicConfig(level=logging.INFO)
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("traces", type=str, nargs="+")
+    parse_args.add_argument("-o", "--output", type=str, default="arc_model.json")
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    traces = []
+    for path in args.traces:
+        with np.load(path) as data:
+            traces.append(data["trace"])
+        logging.info(f"Loaded {len(traces[-1])} frames from {path}")
+
+    model = JumpArcModel.from_traces(traces)
+    model.save(args.output)
+
+    logging.info(f"Calibrated parameters: {model.params}")
+    logging.info(f"Saved arc model to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,53 @@ Your goal is to implement the functions and methods required to enable choose_ac
 Original Mario Manual: https://www.thegameisafootarcade.com/wp-content/uploads/2017/04/Super-Mario-Land-Game-Manual.pdf
 """
 
+import atexit
+import contextlib
+import heapq
+import importlib
+import importlib.util
+import io
 import json
 import logging
-import random
+import os
+import sys
+import time
+import types
+import zlib
+
+class LazyModule(types.ModuleType):
+    """
+    A module built from its real spec whose code only runs when an attribute it doesn't have yet is first used.
+    Unlike importlib's LazyLoader, reading metadata such as __spec__ (which every import statement does) doesn't load it.
+    """
+    def __getattr__(self, attribute):
+        self.__class__ = types.ModuleType
+        self.__spec__.loader.exec_module(self)
+        return getattr(self, attribute)
+
+def lazy_import(name: str):
+    """
+    Registers the module under its real spec without running it, returning the already imported module if there is one.
+
+    Args:
+        name (str): Name of the top level module to import
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return importlib.import_module(name)
+    module = importlib.util.module_from_spec(spec)
+    module.__class__ = LazyModule
+    sys.modules[name] = module
+    return module
+
+#OpenCV is only needed for video and frame capture, registered before mario_environment imports it so headless runs never load it
+cv2 = lazy_import("cv2")
 
-import cv2
 from mario_environment import MarioEnvironment
 from pyboy.utils import WindowEvent
 from enum import Enum, auto
-import curses
 from collections import deque
 import numpy as np
 
@@ -36,6 +74,23 @@ class STATUS(Enum):
     DONE = 0
     MOVING = 1
 
+#cost of taking each link type when searching for the cheapest path (lower is better unlike edge_cost)
+LINK_COST = {
+    LINK.WALK: 1.0,
+    LINK.FALL: 1.0,
+    LINK.JUMP: 2.0,
+    LINK.FAITH_JUMP: 3.0,
+}
+
+def setting(name: str, default):
+    """Returns the MARIO_<name> environment variable cast to the type of default, or default if it is not set"""
+    value = os.environ.get(f"MARIO_{name.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
 class GameGraph:
     def __init__(self) -> None:
         self.node_array = np.full((16,20),None, dtype=object) #generate blank matrix witt 16 rows and 20 cols which is the size of the gamespace
@@ -67,6 +122,1342 @@ class Edge:
         self.finish_col = finish_col
         self.link_type = link_type
 
+#value of each column bit when packing a row of the game area into an integer
+COLUMN_WEIGHTS = 1 << np.arange(20, dtype=np.int64)
+ROW_WEIGHTS = 1 << np.arange(16, dtype=np.int64)
+FULL_ROW = (1 << 20) - 1
+
+class TileBitboard:
+    """
+    Bitboard encoding of the 16x20 game area for constant time terrain queries.
+
+    Every row is packed into one integer per category (bit col is set if that tile belongs to it), along with the transposed column masks (bit row) for the vertical queries.
+    Solid follows the graph builder in treating everything >= 10, enemies included, as something mario can stand on.
+    Anything off the game area is reported as not standable and not clear.
+
+    Args:
+        gamespace (np.ndarray): The 16x20 game area.
+    """
+
+    def __init__(self, gamespace: np.ndarray) -> None:
+        gamespace = np.asarray(gamespace)
+        solid = gamespace >= 10
+        enemy = gamespace >= 15
+        self.rows = len(gamespace)
+        self.solid = (solid * COLUMN_WEIGHTS).sum(axis=1).tolist()
+        self.enemy = (enemy * COLUMN_WEIGHTS).sum(axis=1).tolist()
+        self.terrain = ((solid & ~enemy) * COLUMN_WEIGHTS).sum(axis=1).tolist()
+        self.solid_columns = (solid * ROW_WEIGHTS[:, None]).sum(axis=0).tolist()
+
+    def standable_row(self, row) -> int:
+        """Returns the bitmask of columns in row where mario can stand i.e. solid with two clear tiles above"""
+        if row <= 2 or row >= self.rows:
+            return 0
+        return self.solid[row] & ~self.solid[row-1] & ~self.solid[row-2] & FULL_ROW
+
+    def standable(self, row, col) -> bool:
+        if col < 0 or col >= 20:
+            return False
+        return bool(self.standable_row(row) >> col & 1)
+
+    def headroom_clear(self, row, col) -> bool:
+        """Returns true if the two tiles above (row, col) are not solid"""
+        if row <= 2 or row >= self.rows or col < 0 or col >= 20:
+            return False
+        return not ((self.solid[row-1] | self.solid[row-2]) >> col & 1)
+
+    def is_solid(self, row, col) -> bool:
+        if row < 0 or row >= self.rows or col < 0 or col >= 20:
+            return False
+        return bool(self.solid[row] >> col & 1)
+
+    def gap_below(self, row, col) -> bool:
+        """Returns true if there is nothing solid in the column from row down to the bottom of the screen"""
+        if col < 0 or col >= 20:
+            return False
+        return self.solid_columns[col] >> max(row, 0) == 0
+
+    def column_clear(self, row, col, height) -> bool:
+        """Returns true if the height tiles above (row, col) are not solid"""
+        if row - height < 0 or row > self.rows or col < 0 or col >= 20:
+            return False
+        return (self.solid_columns[col] >> (row - height)) & ((1 << height) - 1) == 0
+
+    def first_solid_below(self, row, col) -> int:
+        """Returns the first solid row at or below row in col, or -1 if there isn't one"""
+        if col < 0 or col >= 20:
+            return -1
+        below = self.solid_columns[col] >> max(row, 0)
+        if below == 0:
+            return -1
+        return max(row, 0) + ((below & -below).bit_length() - 1)
+
+    def enemies_near(self, row, col, above, below, side) -> list:
+        """Returns [row, col] of every enemy tile from row-above to row+below and col-side to col+side, in row then column order"""
+        window = ((1 << (2 * side + 1)) - 1) << max(col - side, 0) if col >= side else (1 << (col + side + 1)) - 1
+        enemies = []
+        for i in range(max(row - above, 0), min(row + below + 1, self.rows)):
+            bits = self.enemy[i] & window
+            while bits:
+                lowest = bits & -bits
+                enemies.append([i, lowest.bit_length() - 1])
+                bits ^= lowest
+        return enemies
+
+class DangerField:
+    """
+    Per-frame danger cost over the whole game area.
+
+    Every enemy tile (value >= 15) spreads a penalty that falls off linearly with the chebyshev distance from the enemy, out to radius tiles.
+    The field is rebuilt once per frame with whole-array shifts so the planner can read the penalty for any tile in O(1).
+    The anytime and incremental planners add the penalty to every edge's cost. The greedy planner never lands on a lethal tile (an enemy's, or the one it is moving into)
+    and otherwise only uses the penalty to choose between moves that make the same progress, as the reachability target does between nodes in the same column.
+
+    Args:
+        radius (int): How many tiles away from an enemy the penalty reaches. Defaults to 3.
+        weight (float): Penalty on the enemy tile itself. Defaults to 12.
+        predict (bool): Whether to also mark where enemies are moving to based on the previous frame. Defaults to True.
+    """
+
+    def __init__(self, radius: int = 3, weight: float = 12.0, predict: bool = True) -> None:
+        self.radius = radius
+        self.weight = weight
+        self.predict = predict
+        self.field = np.zeros((16,20), dtype=np.float32)
+        self.previous = None
+
+    def update(self, gamespace: np.ndarray) -> np.ndarray:
+        enemies = np.asarray(gamespace) >= 15
+        mask = enemies
+        if self.predict and self.previous is not None and self.previous.shape == enemies.shape:
+            mask = enemies | self.predicted(enemies, self.previous)
+        self.previous = enemies
+
+        #every dilation ring adds one share of the weight so the centre gets weight and radius+1 tiles away gets nothing
+        self.field = mask.astype(np.float32)
+        ring = mask
+        for _ in range(self.radius):
+            ring = self.dilate(ring)
+            self.field += ring
+        self.field *= self.weight / (self.radius + 1)
+        return self.field
+
+    def lethal(self, row, col) -> bool:
+        """Returns true if an enemy is on, or moving into, the tile mario would stand in on the node at row col"""
+        return self.penalty(row, col) >= self.weight > 0
+
+    def penalty(self, row, col) -> float:
+        """Returns the danger for mario standing on the node at row col i.e. the tile above the brick"""
+        if row < 1:
+            return 0.0
+        return float(self.field[row-1, col])
+
+    @staticmethod
+    def predicted(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+        """Returns the tiles enemies will step into next based on which side of them was occupied last frame"""
+        left = np.zeros_like(current)
+        right = np.zeros_like(current)
+        left[:, :-1] = previous[:, 1:] #previous[row][col+1]
+        right[:, 1:] = previous[:, :-1] #previous[row][col-1]
+
+        #came from the right so is moving left and the other way around
+        moving_left = current & left & ~right
+        moving_right = current & right & ~left
+
+        ahead = np.zeros_like(current)
+        ahead[:, :-1] |= moving_left[:, 1:]
+        ahead[:, 1:] |= moving_right[:, :-1]
+        return ahead
+
+    @staticmethod
+    def dilate(mask: np.ndarray) -> np.ndarray:
+        """Grows a boolean mask by one tile in all 8 directions"""
+        grown = mask.copy()
+        grown[1:, :] |= mask[:-1, :]
+        grown[:-1, :] |= mask[1:, :]
+        wide = grown.copy()
+        wide[:, 1:] |= grown[:, :-1]
+        wide[:, :-1] |= grown[:, 1:]
+        return wide
+
+#share of a column of progress the greedy search lets a penalty cost an edge, small enough that 51 edges (its longest path) still add up to less than one column
+TIE_BREAK = 1 / 64
+
+def tie_break(penalty: float) -> float:
+    """Maps a non-negative penalty into [0, TIE_BREAK), growing with the penalty so the greedy search prefers the lower one between moves of equal reward"""
+    return TIE_BREAK * penalty / (1.0 + penalty)
+
+class VisitCache:
+    """
+    Bounded record of how often mario keeps coming back to the same situation, to catch him going round in circles.
+
+    Situations are hashed (absolute column, mario row, nearby enemy signature) into a fixed size table of arrival counts that is halved every window steps.
+    Arriving at a situation threshold times is a cycle, and while it lasts the tiles mario arrived at recently cost more to plan through so the planner takes another way.
+    Only arrivals are counted so a stall, mario staying in one situation step after step, never adds up to a cycle and its count decays away with the halving.
+    Stalls are caught separately instead: stall steps in a row in the same situation is a cycle too, until mario moves.
+    In tile world runs mario either moves on the next step or is stuck for 45 steps or more, so the default doesn't fire on normal play.
+
+    Args:
+        size (int): Slots in the count table, colliding situations share a slot. Defaults to 4096.
+        window (int): Steps between halving the counts, also how many recent tiles are penalised. Defaults to 200.
+        threshold (int): Arrivals at one situation that count as a cycle. Defaults to 4.
+        weight (float): Extra path cost for every recent arrival at a tile during a cycle. Defaults to 2.
+        stall (int): Steps in a row in one situation that count as a cycle, 0 to never treat a stall as one. Defaults to 10.
+    """
+
+    def __init__(self, size: int = 4096, window: int = 200, threshold: int = 4, weight: float = 2.0, stall: int = 10) -> None:
+        self.size = size
+        self.window = window
+        self.threshold = threshold
+        self.weight = weight
+        self.stall = stall
+        #steps in a row spent in the current situation
+        self.still = 0
+        self.stalled = False
+        self.counts = np.zeros(size, dtype=np.uint16)
+        self.recent = deque()
+        self.tiles = {}
+        self.last_key = None
+        self.steps = 0
+        self.cycling = False
+        #bumped whenever the penalties change so cached searches know to start again
+        self.version = 0
+
+        self.cycles = 0
+        self.stalls = 0
+        self.cycle_steps = 0
+        self.cycle_frames = 0
+
+    def visit(self, col, row, enemies: tuple) -> bool:
+        """Records a step at absolute column col and returns whether mario is in a cycle"""
+        self.steps += 1
+        if self.steps % self.window == 0:
+            self.counts >>= 1
+
+        #standing still doesn't count as arriving again, it is a stall once it has gone on for stall steps
+        key = hash((col, row, enemies)) % self.size
+        self.still = self.still + 1 if key == self.last_key else 0
+        if key != self.last_key:
+            self.last_key = key
+            self.counts[key] = min(int(self.counts[key]) + 1, 0xFFFF)
+            self.recent.append((col, row))
+            self.tiles[(col, row)] = self.tiles.get((col, row), 0) + 1
+            if len(self.recent) > self.window:
+                oldest = self.recent.popleft()
+                self.tiles[oldest] -= 1
+                if self.tiles[oldest] == 0:
+                    del self.tiles[oldest]
+            if self.cycling:
+                self.version += 1
+
+        stalled = self.stall > 0 and self.still >= self.stall
+        self.stalled = stalled
+        cycling = bool(self.counts[key] >= self.threshold) or stalled
+        if cycling != self.cycling:
+            self.version += 1
+            self.cycles += cycling
+            self.stalls += stalled
+        self.cycling = cycling
+        self.cycle_steps += cycling
+        return cycling
+
+    def ticked(self, frames: int) -> None:
+        """Records the frames the step just decided will run for, lost if mario is in a cycle"""
+        if self.cycling:
+            self.cycle_frames += frames
+
+    def penalty(self, col, row) -> float:
+        """Returns the extra cost of the node at absolute column col, 0 unless mario is in a cycle"""
+        if not self.cycling:
+            return 0.0
+        return self.weight * self.tiles.get((col, row), 0)
+
+    def stats(self) -> dict:
+        return {
+            "cycles": self.cycles,
+            "stalls": self.stalls,
+            "cycle_steps": self.cycle_steps,
+            "frames_lost": self.cycle_frames,
+            "slots_used": int(np.count_nonzero(self.counts)),
+        }
+
+class DecisionScheduler:
+    """
+    Picks how many frames each decision runs for instead of a fixed act_freq.
+
+    The interval grows with mario's clearance, the chebyshev distance in tiles to the nearest enemy or the nearest column ahead or behind with nothing under mario's row:
+    min_frames when one is a tile away, per_tile more for every tile further, up to max_frames on open ground.
+    While mario is in the air with no enemy within enemy_range his trajectory is committed so he waits at least airborne_frames before deciding again.
+    Jump, fall and faith jump edges always run for edge_frames since the executor's button timings for them are tuned to the fixed act_freq.
+    It is off unless MARIO_SCHEDULE=adaptive. In tile world runs (benchmark.py schedule) the greedy planner runs a jump edge almost every decision so nothing changes,
+    and the incremental planner gets further but dies more often than with the fixed act_freq.
+
+    Args:
+        min_frames (int): Frames per decision next to an enemy or gap. Defaults to 4.
+        max_frames (int): Frames per decision with nothing in sight. Defaults to 20.
+        per_tile (int): Frames added per tile of clearance. Defaults to 3.
+        airborne_frames (int): Fewest frames per decision in the air. Defaults to 10.
+        enemy_range (int): Chebyshev distance an enemy counts as close in the air. Defaults to 3.
+        edge_frames (int): Frames per decision running anything but a walk, 0 to schedule them like walks. Defaults to 10.
+    """
+
+    def __init__(self, min_frames: int = 4, max_frames: int = 20, per_tile: int = 3, airborne_frames: int = 10, enemy_range: int = 3, edge_frames: int = 10) -> None:
+        if min_frames < 1 or max_frames < min_frames:
+            raise ValueError(f"Schedule needs 1 <= min_frames <= max_frames, got {min_frames} and {max_frames}")
+        if per_tile < 0 or airborne_frames < 0 or enemy_range < 0 or edge_frames < 0:
+            raise ValueError(f"Schedule per_tile, airborne_frames, enemy_range and edge_frames can't be negative, got {per_tile}, {airborne_frames}, {enemy_range} and {edge_frames}")
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.per_tile = per_tile
+        self.airborne_frames = airborne_frames
+        self.enemy_range = enemy_range
+        self.edge_frames = edge_frames
+
+        #any of the three can be the longest interval handed out
+        self.histogram = np.zeros(max(max_frames, airborne_frames, edge_frames) + 1, dtype=np.int64)
+        self.reasons = {"enemy": 0, "gap": 0, "airborne": 0, "jump": 0, "open": 0}
+
+    def clearance(self, bitboard: TileBitboard, gamespace: np.ndarray, row, col) -> tuple:
+        """Returns (tiles to the nearest enemy, tiles to the nearest gap or wall column) from mario at (row, col), 20 for none"""
+        enemy = 20
+        rows, cols = np.nonzero(gamespace >= 15)
+        if len(rows):
+            #mario is in the tile above the brick he stands on
+            enemy = int(np.maximum(np.abs(rows - (row - 1)), np.abs(cols - col)).min())
+        gap = 20
+        for distance in range(1, 20):
+            if bitboard.gap_below(row, col + distance) or bitboard.gap_below(row, col - distance):
+                gap = distance
+                break
+            #a wall ahead has to be jumped at the right tile just like a gap
+            if bitboard.is_solid(row - 1, col + distance) or bitboard.is_solid(row - 2, col + distance):
+                gap = distance
+                break
+        return enemy, gap
+
+    def frames(self, expert) -> int:
+        """Frames to run the edge expert just pressed for, from the game area it last perceived"""
+        enemy, gap = self.clearance(expert.bitboard, expert.gamespace, expert.mario_row, expert.mario_col)
+        nearest = min(enemy, gap)
+        frames = min(self.min_frames + self.per_tile * max(nearest - 1, 0), self.max_frames)
+        reason = "open" if nearest >= 20 else ("enemy" if enemy <= gap else "gap")
+
+        # C20A       1    Mario is on the ground flag (0x01 = On the ground, 0x00 = In the air)
+        if expert.environment._read_m(0xC20A) == 0 and enemy > self.enemy_range and frames < self.airborne_frames:
+            frames = self.airborne_frames
+            reason = "airborne"
+        elif self.edge_frames and expert.edge is not None and expert.edge.link_type != LINK.WALK:
+            frames = self.edge_frames
+            reason = "jump"
+
+        self.histogram[frames] += 1
+        self.reasons[reason] += 1
+        return frames
+
+    def stats(self) -> dict:
+        decisions = int(self.histogram.sum())
+        frames = int((self.histogram * np.arange(len(self.histogram))).sum())
+        return {
+            "decisions": decisions,
+            "mean_frames": frames / decisions if decisions else 0.0,
+            "decisions_per_second": 60 * decisions / frames if frames else 0.0,
+            "histogram": {int(count): int(self.histogram[count]) for count in np.flatnonzero(self.histogram)},
+            "reasons": self.reasons,
+        }
+
+class AnytimePlanner:
+    """
+    Uniform cost search over the GameGraph that stops when its per-step time budget runs out.
+
+    When the deadline hits the best path found so far (the settled node furthest to the right) is returned.
+    If the next call is made on the same game area, start and target the search carries on from its open list instead of starting again.
+
+    Args:
+        budget_us (int): Time budget for each call to plan in microseconds. Defaults to 2000.
+    """
+
+    def __init__(self, budget_us: int = 2000) -> None:
+        self.budget_us = budget_us
+        self.key = None
+        self.heap = []
+        self.cost = {}
+        self.parent = {}
+        self.closed = set()
+        self.best = None
+        self.done = False
+        self.order = 0
+
+        self.calls = 0
+        self.deadline_hits = 0
+        self.resumes = 0
+        self.expansions = 0
+
+    def reset(self, row, col):
+        self.heap = [(0.0, 0, row, col)]
+        self.cost = {(row,col): 0.0}
+        self.parent = {(row,col): None}
+        self.closed = set()
+        self.best = (row,col)
+        self.done = False
+        self.order = 1
+
+    def plan(self, graph: GameGraph, row, col, target, cost_fn, signature) -> list:
+        """Returns the list of edges from (row, col) towards the target column"""
+        self.calls += 1
+        key = (signature, row, col, target)
+        if key != self.key:
+            self.key = key
+            self.reset(row, col)
+        elif not self.done:
+            self.resumes += 1
+
+        deadline = time.perf_counter_ns() + self.budget_us * 1000
+        while not self.done:
+            if not self.heap:
+                self.done = True
+                break
+            if time.perf_counter_ns() >= deadline:
+                self.deadline_hits += 1
+                break
+
+            cost, _, r, c = heapq.heappop(self.heap)
+            if (r,c) in self.closed:
+                continue
+            self.closed.add((r,c))
+            self.expansions += 1
+
+            #settled nodes are cheapest to reach so the furthest one is the best partial answer
+            best_cost = self.cost[self.best]
+            if c > self.best[1] or (c == self.best[1] and cost < best_cost):
+                self.best = (r,c)
+            if c >= target:
+                self.best = (r,c)
+                self.done = True
+                break
+
+            for edge in graph.node_array[r,c].edge_list:
+                neighbour = (edge.finish_row,edge.finish_col)
+                new_cost = cost + cost_fn(edge)
+                if neighbour not in self.closed and new_cost < self.cost.get(neighbour, float("inf")):
+                    self.cost[neighbour] = new_cost
+                    self.parent[neighbour] = ((r,c), edge)
+                    heapq.heappush(self.heap, (new_cost, self.order, edge.finish_row, edge.finish_col))
+                    self.order += 1
+
+        return self.path(self.best)
+
+    def path(self, node) -> list:
+        edges = deque()
+        while self.parent.get(node) is not None:
+            node, edge = self.parent[node]
+            edges.appendleft(edge)
+        return list(edges)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "deadline_hits": self.deadline_hits,
+            "deadline_rate": self.deadline_hits / self.calls if self.calls else 0.0,
+            "resumes": self.resumes,
+            "expansions": self.expansions,
+        }
+
+class IncrementalPlanner:
+    """
+    D* Lite style search that keeps its search tree between steps and only repairs the parts that changed.
+
+    The search runs backwards from the goal (every node at or past the target column) to mario, over nodes keyed by (row, absolute column) so the screen scrolling doesn't move them.
+    Each call the edge costs of the new graph are compared with the last ones and only the nodes whose outgoing edges changed, mostly the ones near moving enemies, are queued again.
+    Mario moving needs no repair at all since the costs to the goal don't depend on where he starts.
+    There is no heuristic so every cost to the goal it settles is exact, which is why it returns the same paths as searching from scratch.
+
+    Args:
+        incremental (bool): Keep the search tree between calls, False searches from scratch every call. Defaults to True.
+    """
+
+    def __init__(self, incremental: bool = True) -> None:
+        self.incremental = incremental
+        self.reset()
+
+        self.calls = 0
+        self.expansions = 0
+        self.updates = 0
+
+    def reset(self):
+        #node -> {neighbour: (cost, edge)} and node -> set of nodes with an edge into it
+        self.succ = {}
+        self.pred = {}
+        self.g = {}
+        self.rhs = {}
+        self.heap = []
+        self.order = 0
+        self.goal_col = None
+
+    def plan(self, graph: GameGraph, origin, row, col, target, cost_fn) -> list:
+        """Returns the list of edges from (row, col) to the target column, with columns relative to origin"""
+        self.calls += 1
+        if not self.incremental:
+            self.reset()
+
+        succ = {}
+        for r, c in zip(*np.nonzero(graph.node_array != None)):
+            node = graph.node_array[r,c]
+            edges = {}
+            for edge in node.edge_list:
+                neighbour = (edge.finish_row, origin + edge.finish_col)
+                cost = cost_fn(edge)
+                if neighbour not in edges or cost < edges[neighbour][0]:
+                    edges[neighbour] = (cost, edge)
+            succ[(int(r), origin + int(c))] = edges
+
+        #nodes whose way to the goal may have changed: different outgoing edges, or moved in or out of the goal columns
+        goal_col = origin + target
+        changed = []
+        for node in succ.keys() | self.succ.keys():
+            old = self.succ.get(node)
+            new = succ.get(node)
+            if old is None or new is None or {v: e[0] for v, e in old.items()} != {v: e[0] for v, e in new.items()}:
+                changed.append(node)
+            elif self.goal_col is not None and (node[1] >= self.goal_col) != (node[1] >= goal_col):
+                changed.append(node)
+
+        self.succ = succ
+        self.goal_col = goal_col
+        self.pred = {}
+        for node, edges in succ.items():
+            for neighbour in edges:
+                self.pred.setdefault(neighbour, set()).add(node)
+        for node in changed:
+            self.update_vertex(node)
+        #forget nodes that scrolled off or disappeared so memory doesn't grow with the level
+        for node in self.g.keys() | self.rhs.keys():
+            if node not in succ and node not in self.pred:
+                self.g.pop(node, None)
+                self.rhs.pop(node, None)
+        #stale entries are otherwise only dropped when they reach the top
+        if len(self.heap) > len(self.rhs):
+            self.compact()
+        self.updates += len(changed)
+
+        start = (row, origin + col)
+        if start not in succ:
+            return []
+        self.compute(start)
+        return self.path(start)
+
+    def is_goal(self, node) -> bool:
+        return node[1] >= self.goal_col
+
+    def key(self, node) -> float:
+        return min(self.g.get(node, float("inf")), self.rhs.get(node, float("inf")))
+
+    def update_vertex(self, node):
+        if self.is_goal(node):
+            rhs = 0.0
+        else:
+            rhs = min((cost + self.g.get(neighbour, float("inf")) for neighbour, (cost, _) in self.succ.get(node, {}).items()), default=float("inf"))
+        self.rhs[node] = rhs
+        if self.g.get(node, float("inf")) != rhs:
+            heapq.heappush(self.heap, (min(self.g.get(node, float("inf")), rhs), self.order, node))
+            self.order += 1
+
+    def compact(self):
+        """Rebuilds the heap with one entry per node that is still queued under its current key"""
+        queued = {}
+        for key, order, node in self.heap:
+            g = self.g.get(node, float("inf"))
+            rhs = self.rhs.get(node, float("inf"))
+            if node in self.rhs and g != rhs and key == min(g, rhs) and (node not in queued or order < queued[node][1]):
+                queued[node] = (key, order, node)
+        self.heap = list(queued.values())
+        heapq.heapify(self.heap)
+
+    def compute(self, start):
+        while self.heap and (self.heap[0][0] < self.key(start) or self.g.get(start, float("inf")) != self.rhs.get(start, float("inf"))):
+            key, _, node = heapq.heappop(self.heap)
+            g = self.g.get(node, float("inf"))
+            rhs = self.rhs.get(node, float("inf"))
+            #stale entry, the node was settled or queued again with another key since
+            if g == rhs or key != min(g, rhs) or node not in self.rhs:
+                continue
+            self.expansions += 1
+            if g > rhs:
+                self.g[node] = rhs
+            else:
+                self.g[node] = float("inf")
+                self.update_vertex(node)
+            for neighbour in self.pred.get(node, ()):
+                self.update_vertex(neighbour)
+
+    def path(self, start) -> list:
+        """Follows the cheapest edge to the goal from start, ties going to the first edge in the node's edge list"""
+        edges = []
+        node = start
+        while not self.is_goal(node) and len(edges) < len(self.succ):
+            best = None
+            best_cost = float("inf")
+            for neighbour, (cost, edge) in self.succ.get(node, {}).items():
+                if cost + self.g.get(neighbour, float("inf")) < best_cost:
+                    best = (neighbour, edge)
+                    best_cost = cost + self.g.get(neighbour, float("inf"))
+            if best is None:
+                break
+            node, edge = best
+            edges.append(edge)
+        return edges
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "expansions": self.expansions,
+            "expansions_per_call": self.expansions / self.calls if self.calls else 0.0,
+            "updates": self.updates,
+        }
+
+#bit of every node in a column of the 16x20 node grid, node (row, col) is bit row * 20 + col
+COLUMN_BITS = [sum(1 << (row * 20 + col) for row in range(16)) for col in range(20)]
+
+class Reachability:
+    """
+    Bitset reachability over the GameGraph.
+
+    Each node's edges are packed into one integer bitmask and the reachable set grows a whole frontier at a time, so one sweep finds every node reachable from mario.
+    The best reachable node per column is the one with the least danger, then the lowest on the screen.
+    """
+
+    def __init__(self) -> None:
+        self.reachable = 0
+        self.best = [None] * 20
+
+    def update(self, graph: GameGraph, row, col, danger: DangerField = None) -> int:
+        """Returns the bitmask of nodes reachable from (row, col) and fills in best"""
+        adjacency = [0] * 320
+        for i, nodes in enumerate(graph.node_array):
+            for j, node in enumerate(nodes):
+                if node is None:
+                    continue
+                bits = 0
+                for edge in node.edge_list:
+                    bits |= 1 << (edge.finish_row * 20 + edge.finish_col)
+                adjacency[i * 20 + j] = bits
+
+        reachable = frontier = 1 << (row * 20 + col)
+        while frontier:
+            grown = 0
+            while frontier:
+                lowest = frontier & -frontier
+                grown |= adjacency[lowest.bit_length() - 1]
+                frontier ^= lowest
+            frontier = grown & ~reachable
+            reachable |= frontier
+        self.reachable = reachable
+
+        for j in range(20):
+            column = reachable & COLUMN_BITS[j]
+            best = None
+            while column:
+                lowest = column & -column
+                i = (lowest.bit_length() - 1) // 20
+                column ^= lowest
+                score = (danger.penalty(i, j) if danger is not None else 0.0, -i)
+                if best is None or score < best[0]:
+                    best = (score, i)
+            self.best[j] = None if best is None else (best[1], j)
+        return reachable
+
+    def furthest(self):
+        """Returns the best reachable node in the right most column that has one"""
+        for j in range(19, -1, -1):
+            if self.best[j] is not None:
+                return self.best[j]
+        return None
+
+def shifted(array: np.ndarray, rows: int, cols: int, fill=False) -> np.ndarray:
+    """Returns out with out[..., r, c] = array[..., r+rows, c+cols] and fill where that is off the game area"""
+    out = np.full_like(array, fill)
+    height, width = array.shape[-2:]
+    out[..., max(-rows, 0):height - max(rows, 0), max(-cols, 0):width - max(cols, 0)] = \
+        array[..., max(rows, 0):height + min(rows, 0), max(cols, 0):width + min(cols, 0)]
+    return out
+
+class BatchGraph:
+    """
+    generate_graph and Reachability over a stack of game areas at once.
+
+    The links are the same as the graph builder's (fall, walk, jump and faith jump from every standable brick) but go into one (N, 320, 320) boolean adjacency, node (row, col) being index row * 20 + col.
+    Reachability then grows every area's reachable set together, gathering the adjacency rows of every frontier in one go.
+    It is for game areas in bulk, e.g. a recorded area trace (see benchmark.py batch). The agent doesn't use it while playing:
+    its planners walk the GameGraph's Node and Edge objects, and building those is most of what generate_graph costs, so the graph would be built twice.
+
+    Args:
+        areas (np.ndarray): The (N, 16, 20) stacked game areas.
+    """
+
+    def __init__(self, areas: np.ndarray) -> None:
+        areas = np.asarray(areas)
+        self.count = len(areas)
+        solid = areas >= 10
+        rows = np.arange(16)[:, None]
+
+        #standable and headroom_clear of the bitboard, neither holds at row <= 2
+        headroom = ~shifted(solid, -1, 0) & ~shifted(solid, -2, 0) & (rows > 2)
+        self.standable = solid & headroom
+
+        #first solid row at or below each tile, -1 if the column is open underneath
+        below = np.full(areas.shape, -1, dtype=np.int64)
+        below[:, 15] = np.where(solid[:, 15], 15, -1)
+        for row in range(14, -1, -1):
+            below[:, row] = np.where(solid[:, row], row, below[:, row + 1])
+
+        self.adjacency = np.zeros((self.count, 320, 320), dtype=bool)
+        self.nodes = self.standable.copy()
+        for side in (-1, 1):
+            #fall into the first solid tile below an open neighbour
+            fall_row = shifted(below, 0, side, -1)
+            self.link(self.standable & ~shifted(solid, 0, side, True) & (fall_row >= 0), fall_row, side)
+            self.link(self.standable & shifted(self.standable, 0, side), 0, side)
+            #jumps up to 4 rows only start from row 4 down, like check_jump_link
+            for height in range(1, 5):
+                self.link(self.standable & (rows >= 4) & shifted(headroom, -height, 0) & shifted(self.standable, -height, side), -height, side)
+        for i in range(-2, 2):
+            for j in range(-4, 4):
+                self.link(self.standable & shifted(self.standable, i, j), i, j)
+
+    def link(self, mask: np.ndarray, rows, cols: int) -> None:
+        """Adds an edge from every node in mask to the node rows and cols away, rows is an array for falls"""
+        n, i, j = np.nonzero(mask)
+        finish_row = rows[n, i, j] if isinstance(rows, np.ndarray) else i + rows
+        self.adjacency[n, i * 20 + j, finish_row * 20 + j + cols] = True
+        self.nodes[n, finish_row, j + cols] = True
+
+    @staticmethod
+    def mario_positions(areas: np.ndarray):
+        """Returns get_mario_pos for every area as (rows, cols), row being the brick under the lower right corner of mario"""
+        mario = np.asarray(areas) == 1
+        rows = np.where(mario.any(axis=2), np.arange(16), 0).max(axis=1) + 1
+        cols = np.where(mario.any(axis=1), np.arange(20), 0).max(axis=1)
+        return rows, cols
+
+    def reachable(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Returns the (N, 16, 20) nodes reachable from each (row, col), nothing for areas where it isn't a node"""
+        index = np.arange(self.count)
+        valid = rows < 16
+        start = np.zeros((self.count, 16, 20), dtype=bool)
+        start[index[valid], rows[valid], cols[valid]] = True
+        reachable = (start & self.nodes).reshape(self.count, 320)
+
+        #only the adjacency rows of the frontier are gathered, then or'd together per area
+        frontier = reachable
+        while True:
+            area, node = np.nonzero(frontier)
+            if len(area) == 0:
+                break
+            first = np.flatnonzero(np.r_[True, area[1:] != area[:-1]])
+            grown = np.zeros_like(reachable)
+            grown[area[first]] = np.logical_or.reduceat(self.adjacency[area, node], first, axis=0)
+            frontier = grown & ~reachable
+            reachable |= frontier
+        return reachable.reshape(self.count, 16, 20)
+
+    @staticmethod
+    def best(reachable: np.ndarray, danger: np.ndarray = None) -> np.ndarray:
+        """Returns Reachability.best as an (N, 20) array of rows, -1 for columns with nothing reachable"""
+        #the danger of a node is that of the tile mario stands in, one row up
+        penalty = np.zeros(reachable.shape, dtype=np.float32)
+        if danger is not None:
+            penalty[:, 1:] = danger[:, :-1]
+        penalty = np.where(reachable, penalty, np.inf)
+        least = reachable & (penalty == penalty.min(axis=1, keepdims=True))
+        lowest = 15 - np.argmax(least[:, ::-1], axis=1)
+        return np.where(reachable.any(axis=1), lowest, -1)
+
+    def targets(self, rows: np.ndarray, cols: np.ndarray, danger: np.ndarray = None) -> np.ndarray:
+        """Returns plan_target for every area, -1 where there is none"""
+        columns = self.best(self.reachable(rows, cols), danger) >= 0
+        furthest = 19 - np.argmax(columns[:, ::-1], axis=1)
+        ahead = columns.any(axis=1) & (furthest > cols)
+        return np.where(ahead, np.minimum(16, furthest), -1)
+
+class RouteDatabase:
+    """
+    Routes that worked in earlier runs, keyed on (world, stage, absolute column, mario row, on ground).
+
+    Routes are stored as edges relative to mario's node so they still apply wherever the screen has scrolled to.
+    A planned route is only kept once mario has moved at least a tile further right without losing a life.
+    The database is saved to a compressed .npz file and loaded again on startup.
+
+    Args:
+        path (str): The .npz file the database is loaded from and saved to.
+        pending (int): How many unconfirmed routes to hold on to. Defaults to 64.
+    """
+
+    def __init__(self, path: str, pending: int = 64) -> None:
+        self.path = path
+        self.routes = {}
+        self.pending = deque(maxlen=pending)
+
+        self.lookups = 0
+        self.hits = 0
+        self.searches = 0
+        self.search_time = 0.0
+        self.added = 0
+        #mean search time from earlier runs, for estimating the time saved when every lookup hits
+        self.previous_mean = 0.0
+
+        if os.path.exists(path):
+            self.load()
+
+    def load(self) -> None:
+        with np.load(self.path) as data:
+            keys, offsets, edges = data["keys"], data["offsets"], data["edges"]
+            self.previous_mean = float(data["search_mean"])
+        for i, key in enumerate(keys):
+            route = edges[offsets[i]:offsets[i+1]]
+            self.routes[tuple(int(k) for k in key)] = [tuple(int(v) for v in edge) for edge in route]
+        logging.info(f"Loaded {len(self.routes)} routes from {self.path}")
+
+    def save(self) -> None:
+        keys = np.array(list(self.routes.keys()), dtype=np.int32).reshape(-1, 5)
+        lengths = [len(route) for route in self.routes.values()]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int32)
+        edges = np.array([edge for route in self.routes.values() for edge in route], dtype=np.int8).reshape(-1, 3)
+        np.savez_compressed(self.path, keys=keys, offsets=offsets, edges=edges, search_mean=self.mean_search())
+
+    def lookup(self, key, row, col, node_valid) -> Edge:
+        """Returns the first edge of the stored route for key if its landing node is still standable"""
+        self.lookups += 1
+        route = self.routes.get(key)
+        if route is None:
+            return None
+        d_row, d_col, link = route[0]
+        finish_row, finish_col = row + d_row, col + d_col
+        if not (0 <= finish_row < 16 and 0 <= finish_col < 20) or not node_valid(finish_row, finish_col):
+            return None
+        self.hits += 1
+        return Edge(finish_row, finish_col, LINK(link))
+
+    def searched(self, seconds: float) -> None:
+        self.searches += 1
+        self.search_time += seconds
+
+    def propose(self, key, row, col, route: list, state: dict) -> None:
+        if len(route) == 0:
+            return
+        relative = [(edge.finish_row - row, edge.finish_col - col, edge.link_type.value) for edge in route]
+        self.pending.append((key, relative, state["x_position"], state["lives"]))
+
+    def confirm(self, state: dict) -> None:
+        """Keeps the pending routes mario has made progress from, or drops them all if a life was lost"""
+        still_pending = deque(maxlen=self.pending.maxlen)
+        for key, route, x_position, lives in self.pending:
+            if state["lives"] < lives:
+                still_pending.clear()
+                break
+            if state["x_position"] >= x_position + 8:
+                if key not in self.routes:
+                    self.added += 1
+                self.routes[key] = route
+            else:
+                still_pending.append((key, route, x_position, lives))
+        self.pending = still_pending
+
+    def mean_search(self) -> float:
+        return self.search_time / self.searches if self.searches else self.previous_mean
+
+    def stats(self) -> dict:
+        return {
+            "routes": len(self.routes),
+            "added": self.added,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "search_seconds": self.search_time,
+            "saved_seconds": self.hits * self.mean_search(),
+        }
+
+#index of each link type in the executor decision table
+LINK_INDEX = {
+    LINK.WALK: 0,
+    LINK.FALL: 1,
+    LINK.JUMP: 2,
+    LINK.FAITH_JUMP: 3,
+}
+
+#the ACTION values pressed for every 6 bit button mask
+MASK_BUTTONS = [[button for button in range(6) if mask >> button & 1] for mask in range(64)]
+
+#the executor rules only compare positions so targets are quantized to their sign and enemies to +-3 tiles or none
+ENEMY_RANGE = 3
+ENEMY_NONE = 2 * ENEMY_RANGE + 1
+DECISION_SHAPE = (len(LINK_INDEX), 3, 3, ENEMY_NONE + 1, ENEMY_NONE + 1, 2, 3)
+
+class RuleProbe:
+    """
+    Stand-in for MarioController that records the buttons the walk, fall, jump and faith rules press for given RAM flags.
+    """
+
+    def __init__(self, on_ground: int, jump_phase: int) -> None:
+        self.mask = 0
+        self.memory = {0xC20A: on_ground, 0xC207: jump_phase}
+
+    def send_button(self, buttons: list):
+        for button in buttons:
+            self.mask |= 1 << button
+
+    def release_all(self):
+        self.mask = 0
+
+    def _read_m(self, addr: int) -> int:
+        return self.memory.get(addr, 0)
+
+def decision_index(row, col, edge: Edge, enemy_row, enemy_col, on_ground, jump_phase) -> int:
+    """Returns the flat index into the decision table for the current step"""
+    if enemy_row == -1:
+        enemy_x = enemy_y = ENEMY_NONE
+    else:
+        d_col = enemy_col - col
+        d_row = enemy_row - row
+        enemy_x = 0 if d_col < -ENEMY_RANGE else (2 * ENEMY_RANGE if d_col > ENEMY_RANGE else d_col + ENEMY_RANGE)
+        enemy_y = 0 if d_row < -ENEMY_RANGE else (2 * ENEMY_RANGE if d_row > ENEMY_RANGE else d_row + ENEMY_RANGE)
+    target_x = 0 if edge.finish_col < col else (2 if edge.finish_col > col else 1)
+    target_y = 0 if edge.finish_row < row else (2 if edge.finish_row > row else 1)
+
+    index = LINK_INDEX[edge.link_type]
+    index = index * 3 + target_x
+    index = index * 3 + target_y
+    index = index * (ENEMY_NONE + 1) + enemy_x
+    index = index * (ENEMY_NONE + 1) + enemy_y
+    index = index * 2 + (1 if on_ground == 1 else 0)
+    return index * 3 + (jump_phase if jump_phase == 1 or jump_phase == 2 else 0)
+
+def build_decision_table() -> np.ndarray:
+    """
+    Runs the MarioController rules once for every quantized situation and returns the button masks they press.
+
+    The table has shape DECISION_SHAPE, flatten it (e.g. with tobytes) to index it with decision_index.
+    """
+    table = np.zeros(DECISION_SHAPE, dtype=np.uint8)
+    row, col = 8, 8
+    for link, link_index in LINK_INDEX.items():
+        rule = {
+            LINK.WALK: lambda probe, edge, enemy_row, enemy_col: MarioController.walk(probe, col, edge, enemy_col),
+            LINK.FALL: lambda probe, edge, enemy_row, enemy_col: MarioController.fall(probe, row, col, edge, enemy_col),
+            LINK.JUMP: lambda probe, edge, enemy_row, enemy_col: MarioController.jump(probe, row, col, edge, enemy_row, enemy_col),
+            LINK.FAITH_JUMP: lambda probe, edge, enemy_row, enemy_col: MarioController.faith(probe, row, col, edge, enemy_row, enemy_col),
+        }[link]
+        for d_col in (-1, 0, 1):
+            for d_row in (-1, 0, 1):
+                edge = Edge(row + d_row, col + d_col, link)
+                for enemy_x in range(ENEMY_NONE + 1):
+                    for enemy_y in range(ENEMY_NONE + 1):
+                        #none has to be none in both directions
+                        if (enemy_x == ENEMY_NONE) != (enemy_y == ENEMY_NONE):
+                            continue
+                        if enemy_x == ENEMY_NONE:
+                            enemy_row, enemy_col = -1, -1
+                        else:
+                            enemy_row, enemy_col = row + enemy_y - ENEMY_RANGE, col + enemy_x - ENEMY_RANGE
+                        for on_ground in (0, 1):
+                            for jump_phase in (0, 1, 2):
+                                probe = RuleProbe(on_ground, jump_phase)
+                                rule(probe, edge, enemy_row, enemy_col)
+                                table[link_index, d_col + 1, d_row + 1, enemy_x, enemy_y, on_ground, jump_phase] = probe.mask
+    return table
+
+#the table only depends on the rules, so every controller in a process shares the one built first
+_decision_table = None
+
+def decision_table() -> bytes:
+    """Returns build_decision_table flattened, building it the first time it's needed"""
+    global _decision_table
+    if _decision_table is None:
+        _decision_table = build_decision_table().tobytes()
+    return _decision_table
+
+class KinematicsRecorder:
+    """
+    Records MarioController.kinematics every frame so the JumpArcModel can be calibrated offline.
+
+    Args:
+        path (str): The .npz file the trace is written to on save.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.rows = []
+
+    def record(self, controller) -> None:
+        self.rows.append(controller.kinematics())
+
+    def save(self) -> None:
+        np.savez_compressed(self.path, trace=np.array(self.rows, dtype=np.int32))
+
+class AreaRecorder:
+    """
+    Records the game area and the absolute column of its left edge every step so searches can be rerun offline, see benchmark.py incremental.
+
+    Args:
+        path (str): The .npz file the trace is written to on save.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.areas = []
+        self.origins = []
+
+    def record(self, gamespace: np.ndarray, origin) -> None:
+        self.areas.append(np.array(gamespace, dtype=np.uint8))
+        self.origins.append(origin)
+
+    def save(self) -> None:
+        np.savez_compressed(
+            self.path,
+            areas=np.array(self.areas, dtype=np.uint8).reshape(-1, 16, 20),
+            origins=np.array(self.origins, dtype=np.int32),
+        )
+
+#columns of a TraceArchive and their dtypes, link is the LINK value of the edge being run or -1 for none
+TRACE_COLUMNS = {
+    "run": np.uint16,
+    "world": np.uint8,
+    "stage": np.uint8,
+    "x_position": np.uint16,
+    "col": np.int16,
+    "row": np.int8,
+    "link": np.int8,
+    "target_col": np.int16,
+    "target_row": np.int8,
+    "lives": np.uint8,
+    "frames": np.uint32,
+    "plan_us": np.float32,
+    "step_us": np.float32,
+}
+
+class TraceArchive:
+    """
+    Appends a record of every step from any number of runs to memory mapped columnar files, see analyze_traces.py.
+
+    Each column is a flat binary file of one dtype in the archive directory so appending is a write to the end of every file and reading millions of steps back is a np.memmap per column.
+    Records are buffered and appended under a lock so runs sharing an archive never interleave their rows.
+    runs.json lists every run with the rows it has committed, it is only rewritten once all columns are appended so anything past the committed rows
+    is a flush that died part way and is cut off before the next append and by load.
+    Buffered rows are flushed on close, which end_episode and MarioExpert.close run, and at interpreter exit for runs that never get there.
+    col and target_col are absolute columns (screen origin plus the column on screen) of mario's node and of the edge's target.
+
+    Args:
+        path (str): The archive directory, created if it doesn't exist.
+        run_id (str): Name of the run, every run gets its own index into runs.json even if the name repeats.
+        flush_rows (int): Records buffered before they are appended. Defaults to 4096.
+    """
+
+    def __init__(self, path: str, run_id: str, flush_rows: int = 4096) -> None:
+        self.path = path
+        self.flush_rows = flush_rows
+        os.makedirs(path, exist_ok=True)
+        self.buffer = {column: [] for column in TRACE_COLUMNS}
+
+        with self.lock():
+            index = self.index(path)
+            self.run = len(index)
+            index.append({"run": run_id, "rows": 0})
+            self.write_index(index)
+        atexit.register(self.flush)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Holds an exclusive lock on the archive, other runs appending to it wait"""
+        import fcntl
+        with open(f"{self.path}/.lock", "w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def record(self, expert) -> None:
+        environment = expert.environment
+        edge = expert.edge
+        values = {
+            "run": self.run,
+            "world": environment.get_world(),
+            "stage": environment.get_stage(),
+            "x_position": environment.get_x_position(),
+            "col": expert.origin + expert.mario_col,
+            "row": expert.mario_row,
+            "link": -1 if edge is None else edge.link_type.value,
+            "target_col": -1 if edge is None else expert.origin + edge.finish_col,
+            "target_row": -1 if edge is None else edge.finish_row,
+            "lives": environment.get_lives(),
+            "frames": environment.frames,
+            "plan_us": expert.plan_time * 1e6,
+            "step_us": expert.step_time * 1e6,
+        }
+        for column, value in values.items():
+            self.buffer[column].append(value)
+        if len(self.buffer["run"]) >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        rows = len(self.buffer["run"])
+        if not rows:
+            return
+        with self.lock():
+            index = self.index(self.path)
+            committed = sum(entry["rows"] for entry in index)
+            for column, dtype in TRACE_COLUMNS.items():
+                with open(f"{self.path}/{column}.bin", "ab") as file:
+                    #drops whatever a flush that died part way left past the committed rows
+                    file.truncate(committed * np.dtype(dtype).itemsize)
+                    np.array(self.buffer[column], dtype=dtype).tofile(file)
+                self.buffer[column] = []
+            index[self.run]["rows"] += rows
+            self.write_index(index)
+
+    def close(self) -> None:
+        self.flush()
+        atexit.unregister(self.flush)
+
+    def write_index(self, index: list) -> None:
+        #written to a temporary file and renamed over runs.json so a reader never sees half of it
+        with open(f"{self.path}/runs.json.tmp", "w", encoding="utf-8") as file:
+            json.dump(index, file)
+        os.replace(f"{self.path}/runs.json.tmp", f"{self.path}/runs.json")
+
+    @staticmethod
+    def index(path: str) -> list:
+        """Returns [{"run": name, "rows": committed rows}] for every run in the archive"""
+        if not os.path.exists(f"{path}/runs.json"):
+            return []
+        with open(f"{path}/runs.json", "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def runs(path: str) -> list:
+        return [entry["run"] for entry in TraceArchive.index(path)]
+
+    @staticmethod
+    def load(path: str) -> dict:
+        """Returns a read-only memmap of every column, cut to the rows committed in runs.json so a run that died mid append can't misalign them"""
+        rows = sum(entry["rows"] for entry in TraceArchive.index(path))
+        for column, dtype in TRACE_COLUMNS.items():
+            file = f"{path}/{column}.bin"
+            rows = min(rows, os.path.getsize(file) // np.dtype(dtype).itemsize if os.path.exists(file) else 0)
+        columns = {}
+        for column, dtype in TRACE_COLUMNS.items():
+            if rows == 0:
+                columns[column] = np.zeros(0, dtype=dtype)
+            else:
+                columns[column] = np.memmap(f"{path}/{column}.bin", dtype=dtype, mode="r", shape=(rows,))
+        return columns
+
+class ReplayLog:
+    """
+    Compact log of the buttons held on every frame, enough to replay a run exactly from the state it started from since PyBoy is deterministic.
+
+    Frames are run length encoded as (button mask, frames) pairs and a crc32 of work RAM is stored every hash_interval frames so replays can be checked.
+
+    Args:
+        path (str): The .npz file the log is written to on save.
+        hash_interval (int): Frames between state hashes, 0 to turn them off. Defaults to 600.
+    """
+
+    def __init__(self, path: str, hash_interval: int = 600) -> None:
+        self.path = path
+        self.hash_interval = hash_interval
+        self.frames = 0
+        self.runs = []
+        self.hashes = []
+        self.start = None
+
+    def record(self, controller) -> None:
+        if self.frames == 0:
+            self.start = controller.loaded_state
+        self.frames += 1
+        if self.runs and self.runs[-1][0] == controller.held and self.runs[-1][1] < 0xFFFF:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([controller.held, 1])
+        if self.hash_interval and self.frames % self.hash_interval == 0:
+            self.hashes.append([self.frames, self.state_hash(controller.pyboy)])
+
+    @staticmethod
+    def state_hash(pyboy) -> int:
+        """crc32 of work RAM (0xC000 to 0xDFFF)"""
+        return zlib.crc32(bytes(pyboy.memory[0xC000:0xE000]))
+
+    def save(self) -> None:
+        np.savez_compressed(
+            self.path,
+            runs=np.array(self.runs, dtype=np.uint16).reshape(-1, 2),
+            hashes=np.array(self.hashes, dtype=np.uint32).reshape(-1, 2),
+            hash_interval=self.hash_interval,
+            start=self.start or "",
+        )
+
+    @staticmethod
+    def load(path: str) -> tuple:
+        """Returns (a button mask per frame, {frame: hash}, the state file the run started from or None for init.state)"""
+        with np.load(path) as data:
+            runs, hashes = data["runs"], data["hashes"]
+            start = str(data["start"]) if "start" in data else ""
+        masks = np.repeat(runs[:, 0].astype(np.uint8), runs[:, 1].astype(np.int64))
+        return masks, {int(frame): int(crc) for frame, crc in hashes}, start or None
+
+class JumpArcModel:
+    """
+    Lightweight model of Mario's motion in tile space pixels (8 pixels per tile, y grows downwards).
+
+    Horizontal speed is constant for walking or running (B held) and scaled by air_control in the air.
+    While A is held Mario rises at rise_speed for up to max_rise_frames, after which gravity pulls him down to the terminal speed.
+    Many candidate arcs are simulated at once as (candidates, frames) arrays and checked against the solid tiles of the game area.
+
+    Args:
+        params (dict): Overrides for any of the values in DEFAULTS. Defaults to None.
+    """
+
+    DEFAULTS = {
+        "walk_speed": 1.0,
+        "run_speed": 1.5,
+        "air_control": 1.0,
+        "rise_speed": 2.0,
+        "min_rise_frames": 6,
+        "max_rise_frames": 18,
+        "gravity": 0.25,
+        "terminal_speed": 3.0,
+    }
+
+    #candidate controls swept for every link: take off offset within the tile, run flag and frames A is held
+    OFFSETS = (1, 4, 7)
+    RUNS = (0, 1)
+    HOLDS = (6, 9, 12, 15, 18)
+    FRAMES = 64
+
+    def __init__(self, params: dict = None) -> None:
+        self.params = dict(self.DEFAULTS)
+        if params:
+            self.params.update(params)
+
+    @classmethod
+    def load(cls, path: str) -> "JumpArcModel":
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(json.load(file))
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.params, file, indent=4)
+
+    @classmethod
+    def from_traces(cls, traces: list) -> "JumpArcModel":
+        """Fits the model to KinematicsRecorder traces, keeping the default for anything the traces never exercised"""
+        model = cls()
+        params = model.params
+        trace = np.concatenate([np.asarray(t, dtype=np.float64) for t in traces])
+        x, y, ground, phase, held = trace[:-1].T
+        dx = np.abs(np.diff(trace[:, 0]))
+        dy = np.diff(trace[:, 1])
+        held = held.astype(np.int64)
+
+        steering = (held & ((1 << ACTION.LEFT.value) | (1 << ACTION.RIGHT.value))) != 0
+        running = (held & (1 << ACTION.BUTT_B.value)) != 0
+        on_ground = ground == 1
+        #the screen scrolls in steps so use a high percentile of the per frame speed rather than the mean
+        walk = dx[steering & on_ground & ~running]
+        run = dx[steering & on_ground & running]
+        air = dx[steering & ~on_ground & ~running]
+        if walk.size:
+            params["walk_speed"] = float(np.percentile(walk, 90))
+        if run.size:
+            params["run_speed"] = float(np.percentile(run, 90))
+        if air.size and params["walk_speed"] > 0:
+            params["air_control"] = float(np.percentile(air, 90) / params["walk_speed"])
+
+        rising = phase == 1
+        if rising.any():
+            params["rise_speed"] = float(np.median(-dy[rising]))
+            lengths = cls.run_lengths(rising)
+            params["min_rise_frames"] = int(lengths.min())
+            params["max_rise_frames"] = int(lengths.max())
+
+        falling = phase == 2
+        if falling.any():
+            #frames since the apex for every descending frame, then fit speed = gravity * frames
+            frame = np.arange(falling.size)
+            apex = falling & ~np.concatenate(([False], falling[:-1]))
+            since = frame - np.maximum.accumulate(np.where(apex, frame, 0))
+            since = since[falling] + 1
+            speed = dy[falling]
+            params["terminal_speed"] = float(np.percentile(speed, 95))
+            free = speed < params["terminal_speed"]
+            if free.sum() > 1:
+                params["gravity"] = float(np.sum(since[free] * speed[free]) / np.sum(since[free] ** 2))
+        return model
+
+    @staticmethod
+    def run_lengths(mask: np.ndarray) -> np.ndarray:
+        """Returns the length of every run of True in a boolean array"""
+        padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(padded))
+        return edges[1::2] - edges[::2]
+
+    def simulate(self, x0, y0, direction, run, hold) -> tuple:
+        """Returns (x, y, vy) arrays of shape (candidates, FRAMES) for candidates given as 1D arrays"""
+        p = self.params
+        t = np.arange(self.FRAMES, dtype=np.float32)
+        x0, y0, direction, run, hold = (np.asarray(a, dtype=np.float32)[:, None] for a in (x0, y0, direction, run, hold))
+
+        speed = np.where(run > 0, p["run_speed"], p["walk_speed"]) * p["air_control"]
+        x = x0 + direction * speed * (t + 1)
+
+        rise = np.clip(hold, p["min_rise_frames"], p["max_rise_frames"])
+        vy = np.where(t < rise, -p["rise_speed"], np.minimum(p["gravity"] * (t - rise + 1), p["terminal_speed"]))
+        y = y0 + np.cumsum(vy, axis=1)
+        return x, y, vy
+
+    def feasible(self, gamespace: np.ndarray, starts: np.ndarray, finishes: np.ndarray) -> np.ndarray:
+        """Returns a bool per link saying whether any candidate arc from the start node lands on the finish node"""
+        starts = np.asarray(starts).reshape(-1, 2)
+        finishes = np.asarray(finishes).reshape(-1, 2)
+        links = len(starts)
+        if links == 0:
+            return np.zeros(0, dtype=bool)
+
+        #every link gets every combination of the swept controls
+        offsets, runs, holds = np.meshgrid(self.OFFSETS, self.RUNS, self.HOLDS, indexing="ij")
+        variants = offsets.size
+        link = np.repeat(np.arange(links), variants)
+        offsets = np.tile(offsets.ravel(), links)
+        runs = np.tile(runs.ravel(), links)
+        holds = np.tile(holds.ravel(), links)
+
+        direction = np.sign(finishes[link, 1] - starts[link, 1])
+        x, y, vy = self.simulate(starts[link, 1] * 8 + offsets, starts[link, 0] * 8, direction, runs, holds)
+
+        solid = (np.asarray(gamespace) >= 10) & (np.asarray(gamespace) < 15)
+        feet = self.lookup(solid, x, y)
+        body = self.lookup(solid, x, y - 6) | self.lookup(solid, x, y - 14)
+
+        landing = feet & (vy > 0)
+        landed = landing.any(axis=1)
+        when = np.argmax(landing, axis=1)
+        frames = np.arange(self.FRAMES)[None, :]
+        blocked = (body & (frames < when[:, None])).any(axis=1)
+
+        rows = np.floor(y[np.arange(len(when)), when] / 8).astype(np.int64)
+        cols = np.floor(x[np.arange(len(when)), when] / 8).astype(np.int64)
+        #landing next to the target on the same row still lets the walk finish the link
+        hit = landed & ~blocked & (rows == finishes[link, 0]) & (np.abs(cols - finishes[link, 1]) <= 1)
+        return hit.reshape(links, variants).any(axis=1)
+
+    @staticmethod
+    def lookup(solid: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Returns whether each pixel is inside a solid tile. Off the sides counts as solid, above and below the screen as empty"""
+        rows = np.floor(y / 8).astype(np.int64)
+        cols = np.floor(x / 8).astype(np.int64)
+        inside_rows = (rows >= 0) & (rows < solid.shape[0])
+        inside_cols = (cols >= 0) & (cols < solid.shape[1])
+        hits = solid[np.clip(rows, 0, solid.shape[0] - 1), np.clip(cols, 0, solid.shape[1] - 1)]
+        return np.where(inside_cols, hits & inside_rows, True)
+
 class MarioController(MarioEnvironment):
     """
     The MarioController class represents a controller for the Mario game environment.
@@ -85,12 +1476,21 @@ class MarioController(MarioEnvironment):
         emulation_speed: int = 1,
         headless: bool = False,
     ) -> None:
+        #state file reset loads instead of init.state, a stage library entry or a checkpoint
+        self.start_state = None
+        #state file the emulator was last reset to, kept with replay logs
+        self.loaded_state = None
+
         super().__init__(
             act_freq=act_freq,
             emulation_speed=emulation_speed,
             headless=headless,
         )
 
+        self.init_controls(act_freq)
+
+    def init_controls(self, act_freq: int):
+        """Sets up the buttons and executor state, split from __init__ so stand-in environments (tile_world.py) can share it without an emulator"""
         self.act_freq = act_freq
 
         # Example of valid actions based purely on the buttons you can press
@@ -115,6 +1515,67 @@ class MarioController(MarioEnvironment):
         self.valid_actions = valid_actions
         self.release_button = release_button
 
+        #button masks for every quantized situation, set MARIO_EXECUTOR=rules to use the original branches instead
+        self.decision_table = decision_table() if setting("executor", "table") == "table" else None
+
+        #bit mask of the ACTION values currently held down
+        self.held = 0
+        #recorders (KinematicsRecorder, ReplayLog) that are fed every frame
+        self.recorders = []
+        #frames ticked since the controller was created
+        self.frames = 0
+
+        #read-only view of the native 144x160 RGBA screen, PyBoy keeps updating the same buffer
+        self.native_frame = self.screen.ndarray.view()
+        self.native_frame.flags.writeable = False
+        #colour converted native frames grab_frame_into resizes from, keyed by output dimensions
+        self.frame_scratch = {}
+
+    def reset(self, world: int = None, stage: int = None):
+        """
+        Loads the start of the given stage from the stage library, or start_state (init.state if it isn't set) when no stage is given
+        """
+        if world is not None:
+            path = self.stage_path(world, stage)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No start state for {world}-{stage} at {path}, run with MARIO_CHECKPOINTS set to add it to the stage library")
+        else:
+            path = self.start_state if self.start_state is not None else self.init_path
+        with open(path, "rb") as f:
+            self.pyboy.load_state(f)
+        self.loaded_state = path
+
+    def frame_view(self) -> np.ndarray:
+        """
+        Returns the native 144x160 RGBA screen without copying it, copy it to keep it past the next tick
+        """
+        return self.native_frame
+
+    def grab_frame_into(self, out: np.ndarray) -> np.ndarray:
+        """
+        Writes the screen into a preallocated uint8 buffer instead of allocating new arrays like grab_frame.
+
+        A (height, width) buffer gets grayscale and a (height, width, 3) buffer BGR.
+        Buffers smaller than the native screen are downsampled with INTER_AREA, bigger ones upsampled with INTER_LINEAR as grab_frame does.
+        """
+        height, width = out.shape[:2]
+        code = cv2.COLOR_RGBA2GRAY if out.ndim == 2 else cv2.COLOR_RGBA2BGR
+        native_height, native_width, _ = self.native_frame.shape
+        if (height, width) == (native_height, native_width):
+            return cv2.cvtColor(self.native_frame, code, dst=out)
+
+        scratch = self.frame_scratch.get(out.ndim)
+        if scratch is None:
+            scratch = np.empty((native_height, native_width) + out.shape[2:], dtype=np.uint8)
+            self.frame_scratch[out.ndim] = scratch
+        cv2.cvtColor(self.native_frame, code, dst=scratch)
+        downsample = height <= native_height and width <= native_width
+        return cv2.resize(scratch, (width, height), dst=out, interpolation=cv2.INTER_AREA if downsample else cv2.INTER_LINEAR)
+
+    def stage_path(self, world: int, stage: int) -> str:
+        """Where the start state of a stage is kept in the stage library, next to init.state"""
+        return f"{os.path.dirname(self.init_path)}/stages/{world}-{stage}.state"
+
     def run_action(self, current_row,current_col,edge: Edge, enemy_list: deque):
         """
         This is a very basic example of how this function could be implemented
@@ -123,12 +1584,25 @@ class MarioController(MarioEnvironment):
 
         You can change the action type to whatever you want or need just remember the base control of the game is pushing buttons
         """
+        self.press(current_row,current_col,edge,enemy_list)
+
+        # Simply toggles the buttons being on or off for a duration of act_freq
+        # self.pyboy.send_input(self.valid_actions[action])
+        self.tick(self.act_freq)
+
+        return
+
+    def press(self, current_row,current_col,edge: Edge, enemy_list: deque):
+        """Sets the buttons for the edge without ticking, split from run_action so step can pick how many frames to tick after pressing"""
         #release all buttons which may be held down from previous action
         self.release_all()
         [enemy_row, enemy_col] = self.get_nearest_enemy(current_row,current_col,enemy_list)
 
         #if an edge has been passed execute it
-        if edge:
+        if edge and self.decision_table is not None:
+            index = decision_index(current_row,current_col,edge,enemy_row,enemy_col,self._read_m(0xC20A),self._read_m(0xC207))
+            self.send_button(MASK_BUTTONS[self.decision_table[index]])
+        elif edge:
             if edge.link_type.value == LINK.WALK.value:
                 status = self.walk(current_col,edge,enemy_col)
             elif edge.link_type.value == LINK.FALL.value:
@@ -139,14 +1613,29 @@ class MarioController(MarioEnvironment):
                 status = self.faith(current_row,current_col,edge,enemy_row,enemy_col)
         #An edge has not been passed, go right by default
         else:
-            self.pyboy.send_button(self.valid_actions[ACTION.RIGHT.value])
+            self.send_button([ACTION.RIGHT.value])
+        return
 
-        # Simply toggles the buttons being on or off for a duration of act_freq
-        # self.pyboy.send_input(self.valid_actions[action])
-        for _ in range(self.act_freq):
+    def tick(self, frames: int = 1):
+        """Advances the emulator, feeding every attached recorder after each frame"""
+        for _ in range(frames):
             self.pyboy.tick()
+            for recorder in self.recorders:
+                recorder.record(self)
+        self.frames += frames
 
-        return
+    def kinematics(self) -> list:
+        """Returns [absolute x, screen y, on ground flag, jump phase, held buttons] for the current frame"""
+        # C201       1    Mario's Y position on screen
+        # C20A       1    Mario is on the ground flag (0x01 = On the ground, 0x00 = In the air)
+        # C207       1    Probably used in Mario's jump routine. (0x00 = Not jumping, 0x01 = Ascending, 0x02 = Descending)
+        return [
+            self.get_x_position(),
+            self._read_m(0xC201),
+            self._read_m(0xC20A),
+            self._read_m(0xC207),
+            self.held,
+        ]
     
     def get_nearest_enemy(self,row,col,enemies: deque):
         min = [100,100]
@@ -163,6 +1652,7 @@ class MarioController(MarioEnvironment):
     def send_button(self,buttons: list):
         for button in buttons:
             self.pyboy.send_input(self.valid_actions[button])
+            self.held |= 1 << button
         return
     
     def release_all(self):
@@ -171,6 +1661,7 @@ class MarioController(MarioEnvironment):
         """
         for button in range(len(self.release_button)):
             self.pyboy.send_input(self.release_button[button])
+        self.held = 0
         return
     
     def walk(self,col,edge: Edge,enemy_col) -> STATUS:
@@ -328,6 +1819,634 @@ class MarioController(MarioEnvironment):
                     return STATUS.MOVING
                 
 
+class TelemetryEmitter:
+    """
+    Publishes a JSON line of live metrics every interval seconds so long headless runs can be watched with telemetry_tail.py.
+
+    The target is either unix:/path (datagrams to a socket telemetry_tail.py is listening on, dropped if nobody is)
+    or file:/path (appended to a metrics file that is rotated once it reaches max_bytes).
+
+    Args:
+        target (str): Where to publish, unix:/path or file:/path.
+        run_id (str): Name of the run included in every record. Defaults to the process id.
+        interval (float): Seconds between records. Defaults to 1.
+        max_bytes (int): Size a metrics file is rotated at. Defaults to 1MB.
+        backups (int): How many rotated metrics files to keep. Defaults to 3.
+    """
+
+    def __init__(self, target: str, run_id: str = None, interval: float = 1.0, max_bytes: int = 1 << 20, backups: int = 3) -> None:
+        kind, _, path = target.partition(":")
+        if kind not in ("unix", "file") or not path:
+            raise ValueError(f"Telemetry target must be unix:/path or file:/path not {target}")
+        self.kind = kind
+        self.path = path
+        self.run_id = run_id if run_id is not None else str(os.getpid())
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        self.socket = None
+        if kind == "unix":
+            import socket
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+
+        self.last_emit = time.perf_counter()
+        self.last_frames = 0
+        self.steps = 0
+        self.step_time = 0.0
+        self.plan_time = 0.0
+        self.dropped = 0
+
+    def update(self, expert) -> None:
+        """Adds the last step's timings and publishes a record if the interval has passed"""
+        self.steps += 1
+        self.step_time += expert.step_time
+        self.plan_time += expert.plan_time
+        if time.perf_counter() - self.last_emit >= self.interval:
+            self.emit(expert)
+
+    def emit(self, expert, final: bool = False) -> None:
+        now = time.perf_counter()
+        elapsed = max(now - self.last_emit, 1e-9)
+        frames = expert.environment.frames
+        steps = max(self.steps, 1)
+        state = expert.environment.game_state()
+        record = {
+            "run": self.run_id,
+            "time": time.time(),
+            "fps": (frames - self.last_frames) / elapsed,
+            "step_ms": self.step_time / steps * 1000,
+            "plan_ms": self.plan_time / steps * 1000,
+            "x_position": state["x_position"],
+            "lives": state["lives"],
+            "world": state["world"],
+            "stage": state["stage"],
+            "frames": frames,
+            "final": final,
+        }
+        self.publish(json.dumps(record))
+
+        self.last_emit = now
+        self.last_frames = frames
+        self.steps = 0
+        self.step_time = 0.0
+        self.plan_time = 0.0
+
+    def publish(self, line: str) -> None:
+        if self.kind == "unix":
+            try:
+                self.socket.sendto(line.encode("utf-8"), self.path)
+            except OSError:
+                #nobody is listening or the listener is behind, telemetry is best effort
+                self.dropped += 1
+            return
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def rotate(self) -> None:
+        """Shifts metrics.jsonl to metrics.jsonl.1, .1 to .2 and so on, dropping the oldest"""
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i+1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def close(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+
+class CheckpointManager:
+    """
+    Saves the emulator state together with the agent's own state at every stage transition and every interval frames so a run can be resumed (MARIO_RESUME) from any of them.
+
+    The first state seen of each stage is also added to the stage library that MarioController.reset(world, stage) and MARIO_START load from.
+
+    Args:
+        directory (str): Where the checkpoints are written, as name.state and name.json pairs.
+        interval (int): Frames between periodic checkpoints, 0 to only checkpoint at stage transitions. Defaults to 3600.
+        keep (int): How many periodic checkpoints to keep, older ones are deleted. Defaults to 5.
+        library (bool): Whether to add new stages to the stage library. Defaults to True.
+    """
+
+    def __init__(self, directory: str, interval: int = 3600, keep: int = 5, library: bool = True) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.library = library
+        os.makedirs(directory, exist_ok=True)
+
+        self.stage = None
+        self.next_frame = interval
+        self.periodic = deque()
+        self.saved = 0
+        self.added = []
+
+    def update(self, expert) -> None:
+        environment = expert.environment
+        stage = (environment.get_world(), environment.get_stage())
+        if stage != self.stage:
+            self.stage = stage
+            self.save(expert, f"stage_{stage[0]}-{stage[1]}")
+            if self.library:
+                self.add_to_library(environment, *stage)
+        elif self.interval and environment.frames >= self.next_frame:
+            name = f"frame_{environment.frames}"
+            self.save(expert, name)
+            self.periodic.append(name)
+            if len(self.periodic) > self.keep:
+                oldest = self.periodic.popleft()
+                os.remove(f"{self.directory}/{oldest}.state")
+                os.remove(f"{self.directory}/{oldest}.json")
+
+        while self.interval and self.next_frame <= environment.frames:
+            self.next_frame += self.interval
+
+    def save(self, expert, name: str) -> None:
+        environment = expert.environment
+        with open(f"{self.directory}/{name}.state", "wb") as file:
+            environment.pyboy.save_state(file)
+
+        edge = expert.edge
+        agent = {
+            "world": self.stage[0],
+            "stage": self.stage[1],
+            "frames": environment.frames,
+            "x_position": environment.get_x_position(),
+            "lives": environment.get_lives(),
+            "edge": None if edge is None else [edge.finish_row, edge.finish_col, edge.link_type.value],
+            "status": expert.status.value,
+        }
+        with open(f"{self.directory}/{name}.json", "w", encoding="utf-8") as file:
+            json.dump(agent, file)
+        self.saved += 1
+
+    def add_to_library(self, environment, world, stage) -> None:
+        path = environment.stage_path(world, stage)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            environment.pyboy.save_state(file)
+        self.added.append(f"{world}-{stage}")
+        logging.info(f"Added {world}-{stage} to the stage library")
+
+    def stats(self) -> dict:
+        return {
+            "saved": self.saved,
+            "kept": len(self.periodic),
+            "library_added": self.added,
+        }
+
+#entries each per-episode buffer may hold in bounded memory mode, override with MARIO_MEMORY_CAPS=name=cap,name=cap
+MEMORY_CAPS = {
+    "kinematics_rows": 1_000_000,
+    "replay_runs": 1_000_000,
+    "area_trace": 200_000,
+    "trace_buffer": 65_536,
+    "incremental_nodes": 200_000,
+    "incremental_rhs": 200_000,
+    "incremental_heap": 200_000,
+    "anytime_nodes": 20_000,
+    "anytime_heap": 20_000,
+    "routes": 100_000,
+    "graph_edges": 20_000,
+}
+
+class MemoryMonitor:
+    """
+    Opt-in memory instrumentation and bounded memory mode for long runs.
+
+    With trace set, tracemalloc follows the subsystems that allocate every step by wrapping them on the expert: observe (game area, bitboard, danger field),
+    graph (generate_graph's Node and Edge objects), plan (plan_route, including the greedy search's visited and predecessor deques), emulator (tick and the recorders) and frame (grab_frame's copies).
+    Traces are cleared as each call starts, so a snapshot taken as it returns holds exactly the blocks it allocated. Frees of older blocks, like the graph
+    generate_graph replaces, are not traced and can't cancel them the way they do in a difference of traced totals.
+    Per call this gives the most bytes of its own it held at once (allocated) and the bytes it allocated that outlive it (retained), and every sample calls the
+    snapshot's allocation sites are added to the subsystem's top sites.
+    Clearing the traces means nothing is followed across calls, what the run holds over time is followed by the RSS and buffer sizes recorded at every stage transition.
+    Native memory (PyBoy, the VideoWriter) is not seen by tracemalloc and only shows up in the RSS figures.
+
+    With bounded set every per-episode buffer is checked against its cap after every step and a MemoryError is raised as soon as one is over.
+
+    Args:
+        path (str): The json file the report is written to, memory.json next to results.json.
+        trace (bool): Whether to run tracemalloc. Defaults to True.
+        bounded (bool): Whether to enforce the caps. Defaults to False.
+        caps (dict): Cap per buffer name, MEMORY_CAPS for anything not given. Defaults to None.
+        rss_mb (int): Cap on the resident set size in bounded mode, 0 for none. Defaults to 0.
+        top (int): Allocation sites kept per subsystem. Defaults to 10.
+        sample (int): Calls of a subsystem between snapshots of its allocation sites. Defaults to 10.
+    """
+
+    SUBSYSTEMS = ["observe", "graph", "plan", "emulator", "frame"]
+
+    def __init__(self, path: str, trace: bool = True, bounded: bool = False, caps: dict = None, rss_mb: int = 0, top: int = 10, sample: int = 10) -> None:
+        self.path = path
+        self.trace = trace
+        self.bounded = bounded
+        self.caps = dict(MEMORY_CAPS, **(caps or {}))
+        self.rss_mb = rss_mb
+        self.top = top
+        self.sample = sample
+
+        self.tracemalloc = None
+        if trace:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+        self.steps = 0
+        self.calls = dict.fromkeys(self.SUBSYSTEMS, 0)
+        self.allocated = dict.fromkeys(self.SUBSYSTEMS, 0)
+        self.retained = dict.fromkeys(self.SUBSYSTEMS, 0)
+        self.largest = dict.fromkeys(self.SUBSYSTEMS, 0)
+        self.sites = {subsystem: {} for subsystem in self.SUBSYSTEMS}
+        self.sampled = dict.fromkeys(self.SUBSYSTEMS, 0)
+        self.largest_buffers = {}
+        self.stage = None
+        self.snapshots = []
+
+    @staticmethod
+    def parse_caps(text: str) -> dict:
+        """Reads name=cap,name=cap as given in MARIO_MEMORY_CAPS"""
+        caps = {}
+        for item in filter(None, text.split(",")):
+            name, _, cap = item.partition("=")
+            if name.strip() not in MEMORY_CAPS:
+                raise ValueError(f"Unknown memory cap {name}, expected one of {list(MEMORY_CAPS)}")
+            caps[name.strip()] = int(cap)
+        return caps
+
+    def attach(self, expert) -> None:
+        """Wraps the expert's and environment's per-step methods so their allocations are measured"""
+        if self.tracemalloc is None:
+            return
+        expert.observe = self.measured("observe", expert.observe)
+        expert.generate_graph = self.measured("graph", expert.generate_graph)
+        expert.plan_route = self.measured("plan", expert.plan_route)
+        expert.environment.tick = self.measured("emulator", expert.environment.tick)
+        expert.environment.grab_frame = self.measured("frame", expert.environment.grab_frame)
+
+    def measured(self, subsystem: str, function):
+        tracemalloc = self.tracemalloc
+
+        def wrapper(*args, **kwargs):
+            #also resets the peak
+            tracemalloc.clear_traces()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                self.calls[subsystem] += 1
+                self.allocated[subsystem] += peak
+                self.retained[subsystem] += current
+                self.largest[subsystem] = max(self.largest[subsystem], peak)
+                if self.calls[subsystem] % self.sample == 0:
+                    self.sampled[subsystem] += 1
+                    sites = self.sites[subsystem]
+                    for stat in tracemalloc.take_snapshot().statistics("lineno"):
+                        frame = stat.traceback[0]
+                        #the counters above are the wrapper's own
+                        if frame.filename == __file__ and frame.lineno in own:
+                            continue
+                        where = f"{frame.filename}:{frame.lineno}"
+                        sites[where] = sites.get(where, 0) + stat.size
+        own = {line for _, _, line in wrapper.__code__.co_lines() if line is not None}
+        return wrapper
+
+    @staticmethod
+    def rss() -> int:
+        """Resident set size in bytes from /proc, 0 where there is no /proc"""
+        try:
+            with open("/proc/self/statm", "r", encoding="utf-8") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def peak_rss() -> int:
+        import resource
+        #ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @staticmethod
+    def buffers(expert) -> dict:
+        """Entries held by every buffer that grows over an episode"""
+        sizes = {
+            "incremental_nodes": len(expert.incremental.g),
+            "incremental_rhs": len(expert.incremental.rhs),
+            "incremental_heap": len(expert.incremental.heap),
+            "anytime_nodes": len(expert.planner.cost),
+            "anytime_heap": len(expert.planner.heap),
+            "graph_edges": sum(len(node.edge_list) for node in expert.gamegraph.node_array.flat if node is not None),
+        }
+        for recorder in expert.environment.recorders:
+            if isinstance(recorder, KinematicsRecorder):
+                sizes["kinematics_rows"] = len(recorder.rows)
+            elif isinstance(recorder, ReplayLog):
+                sizes["replay_runs"] = len(recorder.runs) + len(recorder.hashes)
+        if expert.area_trace is not None:
+            sizes["area_trace"] = len(expert.area_trace.areas)
+        if expert.trace_archive is not None:
+            sizes["trace_buffer"] = max(len(values) for values in expert.trace_archive.buffer.values())
+        if expert.routes is not None:
+            sizes["routes"] = len(expert.routes.routes)
+        return sizes
+
+    def update(self, expert) -> None:
+        """Called after every step, snapshots at stage transitions and enforces the caps"""
+        self.steps += 1
+        environment = expert.environment
+        stage = (environment.get_world(), environment.get_stage())
+        if stage != self.stage:
+            self.stage = stage
+            self.snapshot(expert, f"{stage[0]}-{stage[1]}")
+
+        if not self.bounded:
+            return
+        for name, size in self.buffers(expert).items():
+            self.largest_buffers[name] = max(self.largest_buffers.get(name, 0), size)
+            if size > self.caps[name]:
+                raise MemoryError(f"{name} holds {size} entries, over its cap of {self.caps[name]} (raise it with MARIO_MEMORY_CAPS={name}=...)")
+        if self.rss_mb:
+            rss = self.rss()
+            if rss > self.rss_mb << 20:
+                raise MemoryError(f"Resident set size is {rss >> 20} MB, over the cap of {self.rss_mb} MB (MARIO_MEMORY_RSS_MB)")
+
+    def snapshot(self, expert, label: str) -> None:
+        record = {
+            "label": label,
+            "frames": expert.environment.frames,
+            "steps": self.steps,
+            "rss": self.rss(),
+            "peak_rss": self.peak_rss(),
+            "buffers": self.buffers(expert),
+        }
+        self.snapshots.append(record)
+
+    def stats(self) -> dict:
+        steps = max(self.steps, 1)
+        stats = {
+            "steps": self.steps,
+            "rss": self.rss(),
+            "peak_rss": self.peak_rss(),
+            "largest_buffers": self.largest_buffers,
+        }
+        if self.tracemalloc is not None:
+            stats["subsystems"] = {
+                subsystem: {
+                    "calls": self.calls[subsystem],
+                    "allocated_per_step": self.allocated[subsystem] / steps,
+                    "retained_per_step": self.retained[subsystem] / steps,
+                    "largest_call": self.largest[subsystem],
+                    #mean bytes retained per sampled call at each site
+                    "top": [
+                        {"where": where, "retained": size / self.sampled[subsystem]}
+                        for where, size in sorted(self.sites[subsystem].items(), key=lambda item: -item[1])[: self.top]
+                    ],
+                }
+                for subsystem in self.SUBSYSTEMS
+            }
+        return stats
+
+    def save(self, expert) -> None:
+        self.snapshot(expert, "end")
+        report = dict(self.stats(), bounded=self.bounded, caps=self.caps if self.bounded else None, snapshots=self.snapshots)
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+#controller owned by each rollout worker process, created by _rollout_worker_init
+_rollout_controller = None
+
+def _rollout_worker_init():
+    global _rollout_controller
+    _rollout_controller = MarioController(emulation_speed=0, headless=True)
+
+def _rollout(state: bytes, macro: list) -> dict:
+    """Runs a macro action, a list of (button mask, frames), from a saved emulator state and reports how it went"""
+    environment = _rollout_controller
+    environment.pyboy.load_state(io.BytesIO(state))
+    lives = environment.get_lives()
+    x_position = environment.get_x_position()
+    score = environment.get_score()
+
+    for mask, frames in macro:
+        environment.release_all()
+        environment.send_button(MASK_BUTTONS[mask])
+        environment.tick(frames)
+
+    return {
+        "progress": environment.get_x_position() - x_position,
+        "died": environment.get_lives() < lives or environment.get_game_over(),
+        "score": environment.get_score() - score,
+    }
+
+class RolloutPool:
+    """
+    Pool of worker processes, each with its own headless emulator, that try candidate macro actions from the current state in parallel.
+
+    The state is serialised once per decision and every candidate is simulated for the same number of frames.
+    Whatever has finished when the wall clock budget runs out is compared and the rest is ignored.
+
+    Args:
+        workers (int): Number of worker processes.
+        frames (int): Frames each candidate is simulated for. Defaults to 60.
+        budget_ms (int): Wall clock budget for one evaluation in milliseconds. Defaults to 50.
+    """
+
+    def __init__(self, workers: int, frames: int = 60, budget_ms: int = 50) -> None:
+        self.workers = workers
+        self.frames = frames
+        self.budget_ms = budget_ms
+        #imported here as most runs never start worker processes
+        import multiprocessing
+        #spawn so the workers don't inherit the parent's emulator or window
+        self.pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_rollout_worker_init)
+
+        #results of rollouts that ran past their budget and are still running
+        self.in_flight = []
+
+        self.evaluations = 0
+        self.rollouts = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+    def macro(self, edge: Edge, col) -> list:
+        """Returns the button mask sequence used to try out an edge"""
+        direction = 0
+        if edge.finish_col > col:
+            direction = 1 << ACTION.RIGHT.value
+        elif edge.finish_col < col:
+            direction = 1 << ACTION.LEFT.value
+        jump = 1 << ACTION.BUTT_A.value
+        run = 1 << ACTION.BUTT_B.value
+
+        if edge.link_type == LINK.JUMP:
+            return [(direction | jump, 15), (direction, self.frames - 15)]
+        if edge.link_type == LINK.FAITH_JUMP:
+            return [(direction | jump | run, 18), (direction | run, self.frames - 18)]
+        return [(direction, self.frames)]
+
+    def free(self) -> int:
+        """Number of workers not still running a rollout that timed out, which can't be cancelled and holds its worker until it ends"""
+        self.in_flight = [result for result in self.in_flight if not result.ready()]
+        return max(self.workers - len(self.in_flight), 0)
+
+    def evaluate(self, state: bytes, macros: list) -> list:
+        """Returns a result dict per macro, or None for the ones that didn't finish within the budget or found no free worker"""
+        self.evaluations += 1
+        import multiprocessing
+        deadline = time.perf_counter() + self.budget_ms / 1000
+
+        #only the free workers are given new work, callers should pass at most free() macros
+        free = self.free()
+        pending = [self.pool.apply_async(_rollout, (state, macro)) for macro in macros[:free]]
+        self.skipped += len(macros) - len(pending)
+
+        results = []
+        for result in pending:
+            try:
+                results.append(result.get(timeout=max(deadline - time.perf_counter(), 0)))
+                self.rollouts += 1
+            except multiprocessing.TimeoutError:
+                results.append(None)
+                self.in_flight.append(result)
+                self.timeouts += 1
+        return results + [None] * (len(macros) - len(pending))
+
+    def close(self) -> None:
+        self.pool.terminate()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "evaluations": self.evaluations,
+            "rollouts": self.rollouts,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "in_flight": len(self.in_flight),
+        }
+
+#planner owned by the pipeline worker process, created by _pipeline_worker_init
+_pipeline_expert = None
+
+def _pipeline_worker_init():
+    global _pipeline_expert
+    _pipeline_expert = MarioExpert.__new__(MarioExpert)
+    _pipeline_expert.init_planning()
+
+#edges the worker follows the greedy planner for on its snapshot, so the plan still has the node mario is on a few steps later
+PIPELINE_EDGES = 8
+
+def _pipeline_plan(gamespace: np.ndarray, origin, cycling: bool, tiles: dict) -> tuple:
+    """
+    Plans on a snapshot of the game area, its absolute origin and the visit penalties.
+
+    Returns (start, edges) with start the (row, absolute col) of mario's node and every edge as (finish row, finish absolute col, link value).
+    """
+    _pipeline_expert.observe(gamespace)
+    _pipeline_expert.origin = origin
+    _pipeline_expert.visits.cycling = cycling
+    _pipeline_expert.visits.tiles = tiles
+    start = (_pipeline_expert.mario_row, origin + _pipeline_expert.mario_col)
+    route = _pipeline_expert.search()
+    if _pipeline_expert.planner_mode == "greedy":
+        route = _pipeline_expert.follow(route, PIPELINE_EDGES)
+    return start, [(edge.finish_row, origin + edge.finish_col, edge.link_type.value) for edge in route]
+
+class PlanningPipeline:
+    """
+    Runs the planner in a worker process on a snapshot of the game area while the emulator keeps ticking the current edge.
+
+    A new snapshot is sent as soon as the previous plan comes back, but only while mario is on the ground since there is no node to plan from in the air.
+    Plans are kept in absolute columns as the chain of nodes they pass through, and route picks the plan up at the node mario is on now,
+    so it is only followed from where mario actually is. Staleness is how many steps old a plan was when it arrived, plans older than max_age steps are dropped.
+    route is empty until the spawned worker sends back its first plan and whenever mario isn't on the plan, so the expert plans itself then.
+
+    Args:
+        max_age (int): Steps old a plan can be when it arrives and still be followed. Defaults to 10.
+    """
+
+    def __init__(self, max_age: int = 10) -> None:
+        self.max_age = max_age
+        #imported here as most runs never start worker processes
+        import concurrent.futures
+        import multiprocessing
+        #spawn so the worker doesn't inherit the emulator or window
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_pipeline_worker_init,
+        )
+        self.future = None
+        self.future_step = 0
+        self.plan = None
+
+        self.steps = 0
+        self.submitted = 0
+        self.airborne = 0
+        self.received = 0
+        self.staleness = 0
+        self.max_staleness = 0
+        self.discarded = 0
+        self.used = 0
+        self.missed = 0
+
+    def update(self, gamespace: np.ndarray, origin, visits: VisitCache, on_ground: bool) -> None:
+        """Picks up a finished plan and sends the latest snapshot, with its origin and visit penalties, if the worker is free and mario is on the ground"""
+        self.steps += 1
+        if self.future is not None and self.future.done():
+            staleness = self.steps - self.future_step
+            self.staleness += staleness
+            self.max_staleness = max(self.max_staleness, staleness)
+            self.received += 1
+            #a plan from too long ago (the first one waits for the worker to start) is dropped rather than followed
+            if staleness <= self.max_age:
+                self.plan = self.future.result()
+            else:
+                self.discarded += 1
+            self.future = None
+
+        if self.future is None and not on_ground:
+            self.airborne += 1
+        elif self.future is None:
+            self.future = self.executor.submit(_pipeline_plan, np.array(gamespace), origin, visits.cycling, dict(visits.tiles))
+            self.future_step = self.steps
+            self.submitted += 1
+
+    def route(self, origin, row, col) -> list:
+        """Returns the rest of the latest plan from mario's node (row, col) in the current screen coordinates, empty if he isn't on it"""
+        if self.plan is not None:
+            start, edges = self.plan
+            current = (row, origin + col)
+            #the last node has nothing left to follow
+            nodes = [start] + [(finish_row, finish_col) for finish_row, finish_col, _ in edges[:-1]]
+            for i, node in enumerate(nodes):
+                if node == current:
+                    self.used += 1
+                    return [Edge(finish_row, finish_col - origin, LINK(link)) for finish_row, finish_col, link in edges[i:]]
+        self.missed += 1
+        return []
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "steps": self.steps,
+            "submitted": self.submitted,
+            "airborne": self.airborne,
+            "received": self.received,
+            "mean_staleness": self.staleness / self.received if self.received else 0.0,
+            "max_staleness": self.max_staleness,
+            "discarded": self.discarded,
+            "used": self.used,
+            "missed": self.missed,
+        }
+
 class MarioExpert:
     """
     The MarioExpert class represents an expert agent for playing the Mario game.
@@ -346,55 +2465,303 @@ class MarioExpert:
 
         self.environment = MarioController(headless=headless)
 
+        self.init_agent()
+
+    @classmethod
+    def from_environment(cls, environment, results_path: str) -> "MarioExpert":
+        """Builds an expert around an environment other than a new MarioController, e.g. a tile_world.TileWorld"""
+        expert = cls.__new__(cls)
+        expert.results_path = results_path
+        expert.environment = environment
+        expert.init_agent()
+        return expert
+
+    def init_agent(self):
+        """Sets up everything besides the environment, reading the MARIO_ settings"""
+        results_path = self.results_path
         self.video = None
+        self.status = STATUS.DONE
+        self.edge = None
+        self.init_planning()
+
+        kinematics_trace = setting("kinematics_trace", "")
+        if kinematics_trace:
+            self.environment.recorders.append(KinematicsRecorder(kinematics_trace))
+        area_trace = setting("area_trace", "")
+        self.area_trace = AreaRecorder(area_trace) if area_trace else None
+        #per step records appended to a shared archive for analyze_traces.py, MARIO_TRACE_ARCHIVE=path/to/archive
+        trace_archive = setting("trace_archive", "")
+        self.trace_archive = None
+        if trace_archive:
+            self.trace_archive = TraceArchive(trace_archive, os.path.basename(os.path.normpath(results_path)))
+        #log of the buttons pressed every frame that replay.py can turn back into video
+        replay = setting("replay", "")
+        self.replay = None
+        if replay:
+            self.start_replay(replay)
+
+        #routes that worked in earlier runs, off unless MARIO_ROUTE_DB=path/to/route_db.npz is set
+        route_db = setting("route_db", "")
+        self.routes = RouteDatabase(route_db) if route_db else None
+
+        #worker emulators for trying out edges near enemies, off unless MARIO_LOOKAHEAD_WORKERS is set
+        workers = setting("lookahead_workers", 0)
+        self.rollouts = None
+        if workers > 0:
+            self.rollouts = RolloutPool(workers, frames=setting("lookahead_frames", 60), budget_ms=setting("lookahead_budget_ms", 50))
+
+        #plan in a worker process while the emulator keeps running, off unless MARIO_PIPELINE is set
+        self.pipeline = PlanningPipeline(max_age=setting("pipeline_max_age", 10)) if setting("pipeline", False) else None
+
+        #live metrics for headless runs, MARIO_TELEMETRY=unix:/path/to.sock or file:/path/to/metrics.jsonl
+        self.plan_time = 0.0
+        self.step_time = 0.0
+        telemetry = setting("telemetry", "")
+        self.telemetry = None
+        if telemetry:
+            self.telemetry = TelemetryEmitter(telemetry, run_id=os.path.basename(os.path.normpath(results_path)), interval=setting("telemetry_interval", 1.0))
+
+        #checkpoints at stage transitions and every MARIO_CHECKPOINT_INTERVAL frames, off unless MARIO_CHECKPOINTS is set
+        self.checkpoints = None
+        if setting("checkpoints", False):
+            self.checkpoints = CheckpointManager(
+                f"{results_path}/checkpoints",
+                interval=setting("checkpoint_interval", 3600),
+                keep=setting("checkpoint_keep", 5),
+                library=setting("stage_library", True),
+            )
+
+        #MARIO_SCHEDULE=adaptive picks the frames per decision from how close enemies and gaps are instead of always act_freq
+        #off by default, in tile world runs it costs the incremental planner more deaths and doesn't change the greedy planner at all
+        self.scheduler = None
+        schedule = setting("schedule", "fixed")
+        if schedule not in ("fixed", "adaptive"):
+            raise ValueError(f"MARIO_SCHEDULE must be fixed or adaptive not {schedule}")
+        if schedule == "adaptive":
+            self.scheduler = DecisionScheduler(
+                min_frames=setting("schedule_min", 4),
+                max_frames=setting("schedule_max", 20),
+                per_tile=setting("schedule_per_tile", 3),
+                airborne_frames=setting("schedule_airborne", 10),
+                enemy_range=setting("schedule_enemy_range", 3),
+                edge_frames=setting("schedule_edge", 10),
+            )
+
+        #memory.json next to results.json with MARIO_MEMORY set, MARIO_MEMORY_BOUNDED fails the run once a per-episode buffer is over its cap
+        trace_memory = setting("memory", False)
+        bounded = setting("memory_bounded", False)
+        self.memory = None
+        if trace_memory or bounded:
+            self.memory = MemoryMonitor(
+                f"{results_path}/memory.json",
+                trace=trace_memory,
+                bounded=bounded,
+                caps=MemoryMonitor.parse_caps(setting("memory_caps", "")),
+                rss_mb=setting("memory_rss_mb", 0),
+            )
+            self.memory.attach(self)
+
+        #start somewhere other than init.state, MARIO_START=2-1 for a stage in the library or MARIO_RESUME=path/to/checkpoint.state
+        start = setting("start", "")
+        if start:
+            world, stage = (int(value) for value in start.split("-"))
+            self.environment.start_state = self.environment.stage_path(world, stage)
+        resume = setting("resume", "")
+        if resume:
+            self.resume(resume)
+
+    def init_planning(self):
+        """Sets up everything choose_action needs to turn a game area into a route, without touching the emulator"""
         self.gamespace = None
+        self.bitboard = None
         self.gamegraph = GameGraph() #create an empty list of nodes
         self.mario_col = 0
         self.mario_row = 0
-        self.status = STATUS.DONE
-        self.edge = None
+        #MARIO_DANGER=0 turns the enemy penalties off, leaving the field at zero
+        self.danger = DangerField(weight=setting("danger_weight", 12.0) if setting("danger", True) else 0.0)
+        self.planner_mode = setting("planner", "greedy") #greedy, anytime or incremental
+        self.planner = AnytimePlanner(budget_us=setting("planner_budget_us", 2000))
+        self.incremental = IncrementalPlanner()
+        self.reachability = Reachability()
+        #situations mario keeps coming back to, and the absolute column of the game area's left edge the penalties are looked up with
+        self.visits = VisitCache(window=setting("cycle_window", 200), threshold=setting("cycle_threshold", 4), weight=setting("cycle_weight", 2.0), stall=setting("cycle_stall", 10))
+        self.origin = 0
+        self.cycling = False
+
+        #a calibrated arc model (see calibrate_arcs.py) lets the graph builder drop jumps mario can't make
+        arc_model = setting("arc_model", "")
+        self.arc_model = JumpArcModel.load(arc_model) if arc_model else None
 
     def choose_action(self):
         state = self.environment.game_state()
-        frame = self.environment.grab_frame()
-        self.gamespace = self.environment.game_area()
-        self.generate_graph()
-        self.get_mario_pos()
+        self.perceive(state,self.environment.game_area())
+        return self.decide(state)
+
+    def perceive(self,state: dict,gamespace: np.ndarray):
+        """Takes in one frame's state and game area, split from choose_action so the observation and the decision can be timed and run separately"""
+        self.observe(gamespace)
+
+        #going round in circles makes the tiles of the loop cost more so the plan changes
+        self.origin = self.screen_origin(state)
+        enemies = tuple((row - self.mario_row, col - self.mario_col) for row, col in self.get_enemy_pos())
+        self.cycling = self.visits.visit(self.origin + self.mario_col,self.mario_row,enemies)
+        if self.area_trace is not None:
+            self.area_trace.record(self.gamespace,self.origin)
+
+    def decide(self,state: dict):
+        """Returns the edge to run next for the frame perceive was last given"""
+        cycling = self.cycling
+        #the terrain is the same every run so a route that worked before skips building the graph and searching
+        if self.routes is not None:
+            key = self.route_key(state)
+            self.routes.confirm(state)
+            #a stored route is what led into the cycle so it is skipped until the cycle is broken,
+            #and it was stored without looking at enemies so it is only replayed when there are none on screen
+            edge = None
+            if not cycling and not any(self.bitboard.enemy):
+                edge = self.routes.lookup(key,self.mario_row,self.mario_col,self.check_node_valid)
+            if edge is not None:
+                return edge
+            start = time.perf_counter()
+
+        #the worker plans on a snapshot while this process keeps running the current edge
+        route = []
+        if self.pipeline is not None:
+            # C20A       1    Mario is on the ground flag (0x01 = On the ground, 0x00 = In the air)
+            self.pipeline.update(self.gamespace,self.origin,self.visits,self.environment._read_m(0xC20A) == 1)
+            route = self.pipeline.route(self.origin,self.mario_row,self.mario_col)
+        #plan here until the worker has started and sent its first plan, and whenever mario isn't on its plan
+        if len(route) == 0:
+            route = self.search()
+        #near enemies try the alternatives in the emulator rather than trusting the plan
+        if self.rollouts is not None and len(self.get_enemy_pos()) > 0:
+            route = self.lookahead(route)
+
+        if self.routes is not None:
+            self.routes.searched(time.perf_counter() - start)
+            self.routes.propose(key,self.mario_row,self.mario_col,route,state)
+        if len(route) == 0:
+            return
+        return route[0]
 
+    def observe(self,gamespace: np.ndarray):
+        """Updates everything that is derived from the game area"""
+        self.gamespace = gamespace
+        self.bitboard = TileBitboard(self.gamespace)
+        self.danger.update(self.gamespace)
+        self.get_mario_pos()
 
+    def search(self) -> list:
+        """Builds the graph for the current game area and returns the planned route"""
+        self.generate_graph()
+        if self.arc_model is not None:
+            self.prune_links()
+        return self.plan_route()
+
+    def follow(self,route: list,length: int) -> list:
+        """Extends a greedy route of one edge up to length edges by planning again from where each one finishes on the same graph, stopping at a loop"""
+        route = list(route)
+        row, col = self.mario_row, self.mario_col
+        seen = {(row, col)}
+        while 0 < len(route) < length:
+            finish = (route[-1].finish_row, route[-1].finish_col)
+            if finish in seen:
+                #the first edge is kept whatever it is, it's what choose_action would run
+                if len(route) > 1:
+                    route.pop()
+                break
+            seen.add(finish)
+            #the greedy search keeps its costs on the nodes
+            for node in self.gamegraph.node_array.flat:
+                if node is not None:
+                    node.cost = 0
+                    node.parent = [0,0]
+                    node.parent_link = None
+            self.mario_row, self.mario_col = finish
+            route += self.plan_route()
+        self.mario_row, self.mario_col = row, col
+        return route
+
+    def screen_origin(self,state: dict) -> int:
+        """Absolute column of the left edge of the game area"""
+        return state["x_position"] // 8 - self.mario_col
+
+    def plan_route(self) -> list:
+        """Returns the edges of the planned path from mario's node, or an empty list if no path was found"""
+        target = self.plan_target()
+        if target is None:
+            return []
 
         #get the path based on Marios position
         visited_list = deque()
         predecessor_list = deque()
         #execute actions
+        if self.planner_mode == "anytime":
+            return self.anytime_route(target)
+        if self.planner_mode == "incremental":
+            return self.incremental.plan(self.gamegraph,self.origin,self.mario_row,self.mario_col,target,self.search_cost)
+
         #Dijkstra only executes when mario is on the ground which is kinda bad cuz he jumps alot
         try:
-            path = self.dijkstra(self.mario_row,self.mario_col,16,visited_list,predecessor_list)
-            return self.gamegraph.node_array[path[1][0],path[1][1]].parent_link
+            path = self.dijkstra(self.mario_row,self.mario_col,target,visited_list,predecessor_list)
+            edge = self.gamegraph.node_array[path[1][0],path[1][1]].parent_link
         except:
-            return
-        # Implement your code here to choose the best action
-        # time.sleep(0.1)
-        # action = self.stdscr.getch()  # Non-blocking read
-        # # action = input()  # Non-blocking read
-
-        # if action == 97: #'a'
-        #     return ACTION.LEFT.value
-        # elif action == 100: #'d'
-        #     return ACTION.RIGHT.value
-        # elif action == 115: #'s'
-        #     return ACTION.DOWN.value
-        # elif action == 119: #'w'
-        #     return ACTION.UP.value
-        # elif action == 98: #'b'
-        #     return ACTION.BUTT_B.value
-        # elif action == 110: #'n'
-        #     return ACTION.BUTT_A.value
-
-        # #Defult option
-        # return ACTION.UP.value
-        # return random.randint(0, len(self.environment.valid_actions) - 1)
-        # return ACTION.RIGHT.value
+            return []
+        return [edge] if edge is not None else []
+
+    def mario_node(self):
+        """Returns the node mario is standing on, None if there isn't one or he is falling off the bottom of the screen"""
+        if self.mario_row >= len(self.gamespace):
+            return None
+        return self.gamegraph.node_array[self.mario_row,self.mario_col]
+
+    def plan_target(self):
+        """Returns the column to plan towards, or None if mario has no node or can't get any further right"""
+        if self.mario_node() is None:
+            return None
+
+        #aim for column 16 if it can be reached at all, otherwise the furthest column that can
+        self.reachability.update(self.gamegraph,self.mario_row,self.mario_col,self.danger)
+        goal = self.reachability.furthest()
+        if goal is None or goal[1] <= self.mario_col:
+            return None
+        return min(16,goal[1])
+
+    def lookahead(self,route: list) -> list:
+        """Simulates every edge out of mario's node in the rollout workers and returns a route starting with the best one"""
+        node = self.mario_node()
+        if node is None:
+            return route
+
+        candidates = {}
+        for edge in list(route[:1]) + sorted(node.edge_list,key=self.search_cost):
+            candidates.setdefault((edge.finish_row,edge.finish_col,edge.link_type),edge)
+        #one candidate per free worker, any more would come back unevaluated
+        candidates = list(candidates.values())[:self.rollouts.free()]
+        if len(candidates) < 2:
+            return route
+
+        state = io.BytesIO()
+        self.environment.pyboy.save_state(state)
+        results = self.rollouts.evaluate(state.getvalue(),[self.rollouts.macro(edge,self.mario_col) for edge in candidates])
+
+        scored = [(result["died"],-result["progress"],-result["score"],i) for i, result in enumerate(results) if result is not None]
+        if len(scored) == 0:
+            return route
+        best = candidates[min(scored)[3]]
+        if len(route) > 0 and best is route[0]:
+            return route
+        return [best]
+
+    def route_key(self,state: dict) -> tuple:
+        """Key for the route database, (world, stage, absolute column, mario row, on ground)"""
+        return (
+            state["world"],
+            state["stage"],
+            state["x_position"] // 8,
+            self.mario_row,
+            self.environment._read_m(0xC20A),
+        )
     
     def generate_graph(self):
         """
@@ -403,38 +2770,52 @@ class MarioExpert:
    
         self.gamegraph.clear()
 
-
-        for i, row in enumerate(self.gamespace):
-            #Check if the node has neighbors
-            for j,grid in enumerate(row):
-                #Check if it is a brick. In the gamespace anything with a value greater than 10 mario can stand on
-                if grid >= 10:
-                    if self.check_node_valid(i,j) == False:
-                        pass
-                    else:
-                        if self.check_node_exist(i,j) == False:
-                        #create a node
-                            self.gamegraph.add_node(i,j)
-
-                        self.check_fall_link(i,j)
-                        self.check_walk_link(i,j)
-                        self.check_jump_link(i,j)
-                        self.check_faith_link(i,j)
+        #only the bricks mario can stand on get a node so walk their bits instead of every tile
+        for i in range(len(self.gamespace)):
+            standable = self.bitboard.standable_row(i)
+            while standable:
+                lowest = standable & -standable
+                j = lowest.bit_length() - 1
+                standable ^= lowest
+
+                if self.check_node_exist(i,j) == False:
+                    #create a node
+                    self.gamegraph.add_node(i,j)
+
+                self.check_fall_link(i,j)
+                self.check_walk_link(i,j)
+                self.check_jump_link(i,j)
+                self.check_faith_link(i,j)
         return
     
+    def prune_links(self):
+        """Removes jump and faith jump links that no arc of the JumpArcModel can complete"""
+        jumps = []
+        for i, row in enumerate(self.gamegraph.node_array):
+            for j, node in enumerate(row):
+                if node is None:
+                    continue
+                for edge in node.edge_list:
+                    if edge.link_type in (LINK.JUMP, LINK.FAITH_JUMP):
+                        jumps.append((node, i, j, edge))
+        if len(jumps) == 0:
+            return
+
+        starts = np.array([[i, j] for _, i, j, _ in jumps])
+        finishes = np.array([[edge.finish_row, edge.finish_col] for _, _, _, edge in jumps])
+        feasible = self.arc_model.feasible(self.gamespace, starts, finishes)
+        for (node, _, _, edge), keep in zip(jumps, feasible):
+            if not keep:
+                node.edge_list.remove(edge)
+        return
+
     def check_node_valid(self,row,col):
         """Returns true if mario can stand on the node"""
-        if (row > 2) and (self.gamespace[row-1][col] <= 9) and (self.gamespace[row-2][col] <= 9) and (self.gamespace[row][col] >= 10):
-            return True
-        else:
-            return False
+        return self.bitboard.standable(row,col)
         
     def check_empty(self,row,col):
         """Returns true if the area above the node is empty i.e zero"""
-        if (row > 2) and (self.gamespace[row-1][col] <= 9) and (self.gamespace[row-2][col] <= 9):
-            return True
-        else:
-            return False
+        return self.bitboard.headroom_clear(row,col)
         
     def check_node_exist(self,row,col):
         """Returns zero if there is no node present at the specified row col position"""
@@ -444,62 +2825,24 @@ class MarioExpert:
             return True
     
     def check_fall_link(self,row,column):
-        #check for empty space left
-        if (column != 0) and (self.gamespace[row][column-1] <= 9):
-            #check for platform below
-            platform_found = False
-            row_temp = row
-            col_temp = column - 1
-            while row_temp < len(self.gamespace) and platform_found == False:
-                #check if the current node is a brick
-                if self.gamespace[row_temp][col_temp] >= 10:
+        #check for empty space left then right
+        for col_temp in (column - 1, column + 1):
+            if (0 <= col_temp < 20) and not self.bitboard.is_solid(row,col_temp):
+                #check for platform below
+                row_temp = self.bitboard.first_solid_below(row,col_temp)
+                if row_temp != -1:
                     #A fall link has been found
                     if self.check_node_exist(row_temp,col_temp) == False:
                         self.gamegraph.add_node(row_temp,col_temp)
                     #add a link
                     self.gamegraph.node_array[row,column].add_edge(row_temp,col_temp,LINK.FALL)
-                    platform_found = True
-                else:
-                    row_temp+=1
-
-        #check for empty space right
-        if (column < len(self.gamespace[row]) - 1) and (self.gamespace[row][column+1] <= 9):
-            #check for platform below
-            platform_found = False
-            row_temp = row
-            col_temp = column + 1
-            while row_temp < len(self.gamespace) and platform_found == False:
-                #check if the current node is a brick
-                if self.gamespace[row_temp][col_temp] >= 10:
-                    #A fall link has been found
-                    if self.check_node_exist(row_temp,col_temp) == False:
-                        self.gamegraph.add_node(row_temp,col_temp)
-                    #add a link
-                    self.gamegraph.node_array[row,column].add_edge(row_temp,col_temp,LINK.FALL)
-                    platform_found = True
-                else:
-                    row_temp+=1
         return
 
     def check_walk_link(self,row,column):
-        #check for nodes to the left
-        col_temp = column - 1
-        if (col_temp >= 0) and (self.gamespace[row][col_temp] >= 10):
+        #check for nodes to the left then right
+        for col_temp in (column - 1, column + 1):
             #make sure the node is valid
-            if self.check_node_valid(row,col_temp) == False:
-                pass
-            else:
-                #add a node if there isn't already one
-                if self.check_node_exist(row,col_temp) == False:
-                    self.gamegraph.add_node(row,col_temp)
-                self.gamegraph.node_array[row,column].add_edge(row,col_temp,LINK.WALK)
-        #check for node to the right
-        col_temp = column + 1
-        if (col_temp < len(self.gamespace[row])) and (self.gamespace[row][col_temp] >= 10):
-            #make sure the node is valid
-            if self.check_node_valid(row,col_temp) == False:
-                pass
-            else:
+            if self.check_node_valid(row,col_temp):
                 #add a node if there isn't already one
                 if self.check_node_exist(row,col_temp) == False:
                     self.gamegraph.add_node(row,col_temp)
@@ -537,18 +2880,21 @@ class MarioExpert:
         #check for nodes to the left
         scan_height = 1
         scan_width = 3
+        first = max(column-scan_width-1,0)
+        last = min(column+scan_width,19)
+        window = ((1 << (last-first+1)) - 1) << first
         for i in range(-scan_height-1,scan_height+1):
-            for j in range(-scan_width-1,scan_width+1):
-                try:
-                    if (self.check_empty(row+i,column+j) == True) and (self.check_node_valid(row+i,column+j)):
-                        #faith link has been found
-                        if (self.check_node_exist(row+i,column+j)) == False:
-                            #make a node at destination
-                            self.gamegraph.add_node(row+i,column+j)
-                        self.gamegraph.node_array[row,column].add_edge(row+i,column+j,LINK.FAITH_JUMP)
-                except:
-                    # this exist for out of bound exceptions
-                    pass
+            #walk the standable bits in the window left to right instead of testing every tile, off the screen is never standable
+            standable = self.bitboard.standable_row(row+i) & window
+            while standable:
+                lowest = standable & -standable
+                j = lowest.bit_length() - 1
+                standable ^= lowest
+                #faith link has been found
+                if (self.check_node_exist(row+i,j)) == False:
+                    #make a node at destination
+                    self.gamegraph.add_node(row+i,j)
+                self.gamegraph.node_array[row,column].add_edge(row+i,j,LINK.FAITH_JUMP)
         return
                                  
 
@@ -566,20 +2912,123 @@ class MarioExpert:
         #     self.status = self.environment.run_action(self.mario_row,self.mario_col,edge)
         #     self.get_mario_pos()
 
+        start = time.perf_counter()
         edge = self.choose_action()
+        self.plan_time = time.perf_counter() - start
+        self.press(edge)
+        self.environment.tick(self.decision_frames())
+        self.step_time = time.perf_counter() - start
+        self.finish_step()
+        return
+
+    def decision_frames(self) -> int:
+        """Frames to run the edge just pressed for before deciding again"""
+        frames = self.environment.act_freq if self.scheduler is None else self.scheduler.frames(self)
+        self.visits.ticked(frames)
+        return frames
+
+    def press(self,edge: Edge):
         #if a new valid new edge exists
         if (edge != None):
-            self.environment.run_action(self.mario_row,self.mario_col,edge,self.get_enemy_pos())
+            self.environment.press(self.mario_row,self.mario_col,edge,self.get_enemy_pos())
             self.edge = edge
         #otherwise a new edge does not exist, perhaps because mario is jumping
         else:
-            # executes+=1
-            self.environment.run_action(self.mario_row,self.mario_col,self.edge,self.get_enemy_pos())
-            # #get unstuck by going left
-            # if(executes > 10000):
-            #     self.environment.send_button([ACTION.LEFT.value])
+            self.environment.press(self.mario_row,self.mario_col,self.edge,self.get_enemy_pos())
+
+    def finish_step(self):
+        """Everything that runs once the frames of a step have been ticked"""
+        if self.checkpoints is not None:
+            self.checkpoints.update(self)
+        if self.trace_archive is not None:
+            self.trace_archive.record(self)
+        if self.telemetry is not None:
+            self.telemetry.update(self)
+        if self.memory is not None:
+            self.memory.update(self)
+        if self.environment.get_game_over():
+            self.end_episode()
         return
 
+    def end_episode(self):
+        """Called once from step when the game is over to report the stats gathered during the episode"""
+        if self.planner_mode == "anytime":
+            logging.info(f"Planner Stats: {self.planner.stats()}")
+        elif self.planner_mode == "incremental":
+            logging.info(f"Planner Stats: {self.incremental.stats()}")
+        for recorder in self.environment.recorders:
+            recorder.save()
+        if self.area_trace is not None:
+            self.area_trace.save()
+        if self.routes is not None:
+            self.routes.save()
+            logging.info(f"Route Stats: {self.routes.stats()}")
+        if self.rollouts is not None:
+            logging.info(f"Lookahead Stats: {self.rollouts.stats()}")
+        if self.pipeline is not None:
+            logging.info(f"Pipeline Stats: {self.pipeline.stats()}")
+        logging.info(f"Cycle Stats: {self.visits.stats()}")
+        if self.scheduler is not None:
+            logging.info(f"Schedule Stats: {self.scheduler.stats()}")
+        if self.checkpoints is not None:
+            logging.info(f"Checkpoint Stats: {self.checkpoints.stats()}")
+        if self.telemetry is not None:
+            self.telemetry.emit(self, final=True)
+            self.telemetry.close()
+        if self.memory is not None:
+            self.memory.save(self)
+            logging.info(f"Memory Stats: peak RSS {self.memory.peak_rss() >> 20} MB, written to {self.memory.path}")
+        self.close()
+
+    def close(self):
+        """
+        Stops the worker processes and flushes the trace archive, run by end_episode and by anything that stops playing before the game is over (e.g. on a frame budget) in a finally.
+        Safe to call more than once.
+        """
+        if self.rollouts is not None:
+            self.rollouts.close()
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self.trace_archive is not None:
+            self.trace_archive.close()
+
+    def resume(self, path: str):
+        """Makes the next reset continue from a checkpoint written by CheckpointManager, restoring the agent state saved with it"""
+        with open(f"{os.path.splitext(path)[0]}.json", "r", encoding="utf-8") as file:
+            agent = json.load(file)
+        self.environment.start_state = path
+        self.environment.frames = agent["frames"]
+        self.status = STATUS(agent["status"])
+        if agent["edge"] is not None:
+            row, col, link_type = agent["edge"]
+            self.edge = Edge(row, col, LINK(link_type))
+        #the stage was already checkpointed from its start, not from here
+        if self.checkpoints is not None:
+            self.checkpoints.stage = (agent["world"], agent["stage"])
+        logging.info(f"Resuming from {path} at {agent['world']}-{agent['stage']} x {agent['x_position']}")
+
+    def start_replay(self, path: str):
+        self.replay = ReplayLog(path, hash_interval=setting("replay_hash_interval", 600))
+        self.environment.recorders.append(self.replay)
+
+    def record(self):
+        """
+        Plays the same way as play but logs the button inputs to mario_expert.replay.npz instead of encoding mario_expert.mp4.
+
+        Run replay.py on the log to get the video, or any single frame, back.
+        """
+        self.environment.reset()
+        if self.replay is None:
+            self.start_replay(f"{self.results_path}/mario_expert.replay.npz")
+
+        while not self.environment.get_game_over():
+            self.step()
+
+        final_stats = self.environment.game_state()
+        logging.info(f"Final Stats: {final_stats}")
+
+        with open(f"{self.results_path}/results.json", "w", encoding="utf-8") as file:
+            json.dump(final_stats, file)
 
     def play(self):
         """
@@ -640,17 +3089,7 @@ class MarioExpert:
 
     def get_enemy_pos(self):
         #returns a list of coordinates for any enemys within 2 tiles of mario. Is -1 if no enemy
-        enemy_list = deque()
-
-        for i in range(-5,4):
-            for j in range(-3,4):
-                try:
-                    if self.gamespace[self.mario_row+ i][self.mario_col + j] >= 15:
-                        enemy_list.append([self.mario_row+i,self.mario_col+j])
-                except:
-                    #this exist for out of bound exceptions
-                    pass
-        return enemy_list
+        return deque(self.bitboard.enemies_near(self.mario_row,self.mario_col,5,3,3))
 
     def dijkstra(self,row,col,target,visited_list,predecessor_list:deque):
 
@@ -669,6 +3108,12 @@ class MarioExpert:
                 y_coords = coords[0]
                 current_vertex = self.gamegraph.node_array[y_coords,x_coords]
                 for edge in current_vertex.edge_list:
+                    #a stall is mario taking an edge onto his own node the executor never finishes, so those are skipped until he moves
+                    if self.visits.stalled and edge.finish_row == y_coords and edge.finish_col == x_coords:
+                        continue
+                    #never land where an enemy is or is about to be
+                    if self.danger.lethal(edge.finish_row,edge.finish_col):
+                        continue
                     #update cost for each reacheable node if there is a better way to get there (higher "cost" function which I know is backwards stfu)
                     if self.gamegraph.node_array[row,col].cost + self.edge_cost(edge) >= self.gamegraph.node_array[edge.finish_row,edge.finish_col].cost:
                         self.gamegraph.node_array[edge.finish_row,edge.finish_col].cost = self.gamegraph.node_array[row,col].cost + self.edge_cost(edge)#cost of current node + edge cost
@@ -686,8 +3131,18 @@ class MarioExpert:
             return predecessor_list
 
 
+    def anytime_route(self,target):
+        """Returns the best path the anytime planner found before its deadline"""
+        return self.planner.plan(self.gamegraph,self.mario_row,self.mario_col,target,self.search_cost,(self.gamespace.tobytes(),self.danger.field.tobytes(),self.visits.version))
+
+    def search_cost(self,edge: Edge):
+        """Positive cost of taking an edge, used by the searches that look for the cheapest path"""
+        return LINK_COST[edge.link_type] + self.danger.penalty(edge.finish_row,edge.finish_col) + self.visits.penalty(self.origin + edge.finish_col,edge.finish_row)
+
     def edge_cost(self,edge: Edge):
+        #penalties only break ties between moves that make the same progress, taking them off the reward itself made mario plan behind himself
         reward = edge.finish_col + edge.link_type.value*2
+        reward -= tie_break(self.danger.penalty(edge.finish_row,edge.finish_col) + self.visits.penalty(self.origin + edge.finish_col,edge.finish_row))
         return reward
 
         
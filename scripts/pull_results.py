@@ -1,34 +1,138 @@
+"""
+Fetches every submission and runs each one headless in its own virtualenv.
+
+    python3 pull_results.py
+    python3 pull_results.py --backend local --root ~/submissions --no-run
+
+Each submission gets its own directory, submissions/{upi}, with copies of the framework scripts next to its mario_expert.py
+and symlinks to the shared roms and results, so submissions can be fetched and run in parallel without writing over each other.
+Listings and downloads run concurrently on --workers threads, with a Drive client per thread as pydrive2's isn't thread safe.
+Files that haven't changed since the last fetch (same md5, or same modification time when the backend has no hashes) are not downloaded again.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
 import os
+import shutil
 import subprocess
+import threading
 from pathlib import Path
 
-import virtualenv
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
+logging.basicConfig(level=logging.INFO)
+
+#the framework files run.py needs next to a submitted mario_expert.py
+FRAMEWORK_FILES = ["run.py", "mario_environment.py", "pyboy_environment.py"]
+
+# COMPSYS726 - Assignment 1 Folder
+PRIMARY_FOLDER_ID = "1xM3Dhtm3YCoLnMFTMxyZnhJVvHsYbFgn"
+
+
+class DriveBackend:
+    """
+    Lists and downloads submissions from Google Drive.
 
+    The pydrive2 client and its http connection aren't thread safe, so every thread that calls list or download gets its own client
+    authorised with the credentials from the one sign in.
+    """
 
-def read_folder(drive, title, file_id):
-    folder = {}
+    def __init__(self) -> None:
+        from pydrive2.auth import GoogleAuth
 
-    folder["title"] = title
-    folder["files"] = {}
-    folder["folders"] = []
+        self.gauth = GoogleAuth()
+        self.gauth.LocalWebserverAuth()
+        self.clients = threading.local()
 
-    drive_list = drive.ListFile(
-        {"q": f"'{file_id}' in parents and trashed=false"}
-    ).GetList()
+    @property
+    def drive(self):
+        """This thread's GoogleDrive client, created on first use"""
+        if not hasattr(self.clients, "drive"):
+            from pydrive2.auth import GoogleAuth
+            from pydrive2.drive import GoogleDrive
 
-    for f in drive_list:
-        if f["mimeType"] == "application/vnd.google-apps.folder":
-            folder["folders"].append(read_folder(drive, f["title"], f["id"]))
-        else:
-            folder["files"][f["title"]] = {
+            gauth = GoogleAuth()
+            gauth.credentials = self.gauth.credentials
+            gauth.Authorize()
+            self.clients.drive = GoogleDrive(gauth)
+        return self.clients.drive
+
+    def list(self, folder_id) -> list:
+        drive_list = self.drive.ListFile({"q": f"'{folder_id}' in parents and trashed=false"}).GetList()
+        return [
+            {
                 "id": f["id"],
                 "title": f["title"],
-                "title1": f["alternateLink"],
+                "folder": f["mimeType"] == "application/vnd.google-apps.folder",
+                "link": f.get("alternateLink"),
+                "md5": f.get("md5Checksum"),
+                "modified": f.get("modifiedDate"),
             }
+            for f in drive_list
+        ]
+
+    def download(self, file_id, path) -> None:
+        file = self.drive.CreateFile({"id": file_id})
+        file.GetContentFile(path)
+
+
+class LocalBackend:
+    """
+    Stand-in for Google Drive that reads submissions from a local directory laid out the same way, {upi}/mario_expert.py and {upi}/requirements.txt.
+
+    Ids are paths and files carry no md5 so changes are found by modification time.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = os.path.abspath(os.path.expanduser(root))
+
+    def list(self, folder_id) -> list:
+        entries = []
+        with os.scandir(folder_id) as scan:
+            for entry in scan:
+                stat = entry.stat()
+                entries.append(
+                    {
+                        "id": entry.path,
+                        "title": entry.name,
+                        "folder": entry.is_dir(),
+                        "link": entry.path,
+                        "md5": None,
+                        "modified": f"{stat.st_mtime_ns}:{stat.st_size}",
+                    }
+                )
+        return entries
 
-    return folder
+    def download(self, file_id, path) -> None:
+        shutil.copyfile(file_id, path)
+
+
+def read_folder(backend, title, file_id, workers=8):
+    """Lists the folder tree a level at a time with every folder of a level listed concurrently"""
+    root = {"title": title, "files": {}, "folders": []}
+    level = [(root, file_id)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while level:
+            listings = executor.map(lambda item: backend.list(item[1]), level)
+            next_level = []
+            for (folder, _), entries in zip(level, listings):
+                for f in entries:
+                    if f["folder"]:
+                        child = {"title": f["title"], "files": {}, "folders": []}
+                        folder["folders"].append(child)
+                        next_level.append((child, f["id"]))
+                    else:
+                        folder["files"][f["title"]] = {
+                            "id": f["id"],
+                            "title": f["title"],
+                            "title1": f["link"],
+                            "md5": f["md5"],
+                            "modified": f["modified"],
+                        }
+            level = next_level
+
+    return root
 
 
 def print_folders(directory, tab=0):
@@ -44,50 +148,151 @@ def print_folders(directory, tab=0):
         print_folders(folder, tab=tab + 5)
 
 
-def run_venv(upi, requirement_path):
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class FetchCache:
+    """
+    Remembers the version of every file downloaded so unchanged files are skipped on the next fetch.
+
+    Args:
+        path (str): The json file the versions are kept in.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.versions = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.versions = json.load(file)
+
+    def unchanged(self, file, destination) -> bool:
+        if not os.path.exists(destination):
+            return False
+        #a hash from the backend is checked against the file itself, otherwise the modification time against the last fetch
+        if file["md5"] is not None:
+            return file_md5(destination) == file["md5"]
+        return self.versions.get(destination) == file["modified"]
+
+    def update(self, file, destination) -> None:
+        self.versions[destination] = file["md5"] or file["modified"]
+
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(self.versions, file, indent=4)
+
+
+def prepare_submission(package_path, submission_path):
+    """Copies the framework scripts into the submission's own directory and links the shared roms and results"""
+    os.makedirs(f"{submission_path}/scripts", exist_ok=True)
+    for name in FRAMEWORK_FILES:
+        source = f"{package_path}/scripts/{name}"
+        destination = f"{submission_path}/scripts/{name}"
+        if not os.path.exists(destination) or os.path.getmtime(destination) < os.path.getmtime(source):
+            shutil.copy2(source, destination)
+
+    #run.py finds both relative to its own directory
+    os.makedirs(f"{package_path}/results", exist_ok=True)
+    for name in ["roms", "results"]:
+        link = f"{submission_path}/{name}"
+        if not os.path.islink(link):
+            os.symlink(f"{package_path}/{name}", link)
+
+
+def fetch(backend, directory, submissions_path, package_path, workers=8):
+    """Downloads every changed requirements.txt and mario_expert.py concurrently, returns {upi: submission directory}"""
+    cache = FetchCache(f"{submissions_path}/fetch_cache.json")
+
+    submissions = {}
+    downloads = []
+    for folders in directory["folders"]:
+        upi = folders["title"]
+        files = folders["files"]
+        if "requirements.txt" not in files or "mario_expert.py" not in files:
+            logging.warning(f"Skipping {upi}, it is missing requirements.txt or mario_expert.py")
+            continue
+
+        submission_path = f"{submissions_path}/{upi}"
+        prepare_submission(package_path, submission_path)
+        submissions[upi] = submission_path
+
+        downloads.append((files["requirements.txt"], f"{submission_path}/requirements.txt"))
+        downloads.append((files["mario_expert.py"], f"{submission_path}/scripts/mario_expert.py"))
+
+    def download(job):
+        file, destination = job
+        if cache.unchanged(file, destination):
+            return False
+        backend.download(file["id"], destination)
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        downloaded = list(executor.map(download, downloads))
+    for (file, destination), _ in zip(downloads, downloaded):
+        cache.update(file, destination)
+    cache.save()
+
+    logging.info(f"Downloaded {sum(downloaded)} files, {len(downloaded) - sum(downloaded)} unchanged")
+    return submissions
+
+
+def run_venv(upi, submission_path):
+    import virtualenv
+
     path = f"{os.path.expanduser('~')}/venv"
     venv_dir = os.path.join(path, f"{upi}")
     virtualenv.cli_run([venv_dir])
 
     python_bin = f"{path}/{upi}/bin/python3"
 
-    command = f". {venv_dir}/bin/activate && pip install -r {requirement_path}/requirements.txt"
+    command = f". {venv_dir}/bin/activate && pip install -r {submission_path}/requirements.txt"
     os.system(command)
 
-    return subprocess.Popen([python_bin, "run.py", "--upi", upi, "--headless"])
+    return subprocess.Popen([python_bin, "run.py", "--upi", upi, "--headless"], cwd=f"{submission_path}/scripts")
 
 
-def main():
-    gauth = GoogleAuth()
-    gauth.LocalWebserverAuth()
-
-    drive = GoogleDrive(gauth)
+def get_args():
+    parse_args = argparse.ArgumentParser()
 
-    # COMPSYS726 - Assignment 1 Folder
-    primary_folder_id = "1xM3Dhtm3YCoLnMFTMxyZnhJVvHsYbFgn"
+    parse_args.add_argument("--backend", type=str, default="drive", choices=["drive", "local"])
+    parse_args.add_argument("--root", type=str, default=None, help="submissions directory for the local backend")
+    parse_args.add_argument("--submissions", type=str, default=f"{Path(__file__).parent.parent}/submissions")
+    parse_args.add_argument("--workers", type=int, default=8, help="concurrent listings and downloads")
+    parse_args.add_argument("--no-run", action="store_true", help="only fetch the submissions")
 
-    directory = read_folder(drive, "COMPSYS726 - Assignments", primary_folder_id)
+    return parse_args.parse_args()
 
-    print_folders(directory)
 
-    sub_processes = {}
-    for folders in directory["folders"]:
-        upi = folders["title"]
-        print(f"Title: {upi}")
-
-        files = folders["files"]
-        requirements_id = files["requirements.txt"]["id"]
-        mario_expert_id = files["mario_expert.py"]["id"]
+def main():
+    args = get_args()
 
-        requirement_path = f"{Path(__file__).parent.parent}"
+    if args.backend == "drive":
+        backend = DriveBackend()
+        title, folder_id = "COMPSYS726 - Assignments", PRIMARY_FOLDER_ID
+    else:
+        if args.root is None:
+            raise ValueError("The local backend needs --root")
+        backend = LocalBackend(args.root)
+        title, folder_id = args.root, backend.root
+    directory = read_folder(backend, title, folder_id, args.workers)
 
-        file = drive.CreateFile({"id": requirements_id})
-        file.GetContentFile(f"{requirement_path}/requirements.txt")
+    print_folders(directory)
 
-        file = drive.CreateFile({"id": mario_expert_id})
-        file.GetContentFile("mario_expert.py")
+    os.makedirs(args.submissions, exist_ok=True)
+    package_path = f"{Path(__file__).parent.parent.resolve()}"
+    submissions = fetch(backend, directory, args.submissions, package_path, args.workers)
+    if args.no_run:
+        return
 
-        p = run_venv(upi, requirement_path)
+    sub_processes = {}
+    for upi, submission_path in submissions.items():
+        print(f"Title: {upi}")
+        p = run_venv(upi, submission_path)
         sub_processes[upi] = p
 
     for upi, p in sub_processes.items():
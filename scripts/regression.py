@@ -0,0 +1,172 @@
+"""
+Headless regression suite, runs the agent from a set of start states for a fixed number of frames and compares progress and throughput against a stored baseline.
+
+    python3 regression.py --update-baseline
+    python3 regression.py 1-1 1-2 --frames 6000
+
+Start states are init.state (named init) and the stage library entries written by runs with MARIO_CHECKPOINTS set.
+The route database is off unless --routes is given so every run plans from nothing, exits with 1 if anything regressed.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+
+from mario_expert import MarioExpert
+
+logging.basicConfig(level=logging.INFO)
+
+#metrics where bigger is better, a drop of more than the tolerance is a regression
+HIGHER_BETTER = ["progress", "progress_per_cpu_s"]
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("starts", type=str, nargs="*", help="init or world-stage, defaults to init and every stage in the library")
+    parse_args.add_argument("--frames", type=int, default=3600, help="frame budget for each start state")
+    parse_args.add_argument("--baseline", type=str, default="regression_baseline.json")
+    parse_args.add_argument("--update-baseline", action="store_true")
+    parse_args.add_argument("--tolerance", type=float, default=0.05, help="relative drop allowed before flagging a regression")
+    parse_args.add_argument("--routes", type=str, default="", help="route database to use, off by default")
+
+    return parse_args.parse_args()
+
+
+def new_expert(results_path):
+    expert = MarioExpert(results_path=results_path, headless=True)
+    #MarioController defaults to real time, the suite runs as fast as the emulator can
+    expert.environment.pyboy.set_emulation_speed(0)
+    return expert
+
+
+def library_starts(environment):
+    paths = glob.glob(environment.stage_path("*", "*"))
+    return ["init"] + sorted(os.path.basename(path)[: -len(".state")] for path in paths)
+
+
+def run_start(expert, start, frames):
+    """Runs the expert from one start state for a frame budget and returns its metrics"""
+    environment = expert.environment
+    if start == "init":
+        environment.start_state = None
+    else:
+        world, stage = (int(value) for value in start.split("-"))
+        environment.start_state = environment.stage_path(world, stage)
+    environment.reset()
+
+    #split the process time between the planner and the emulator
+    cpu = {"planner": 0.0, "emulator": 0.0}
+    choose_action, tick = expert.choose_action, environment.tick
+
+    def timed_choose_action():
+        start_cpu = time.process_time()
+        try:
+            return choose_action()
+        finally:
+            cpu["planner"] += time.process_time() - start_cpu
+
+    def timed_tick(frames=1):
+        start_cpu = time.process_time()
+        tick(frames)
+        cpu["emulator"] += time.process_time() - start_cpu
+
+    expert.choose_action = timed_choose_action
+    environment.tick = timed_tick
+
+    first_frame = environment.frames
+    lives = environment.get_lives()
+    deaths = 0
+    #furthest x reached in each stage, minus where the stage was started
+    x_position = environment.get_x_position()
+    stages = {(environment.get_world(), environment.get_stage()): [x_position, x_position]}
+    start_wall = time.perf_counter()
+    while environment.frames - first_frame < frames and not environment.get_game_over():
+        expert.step()
+        stage = (environment.get_world(), environment.get_stage())
+        x_position = environment.get_x_position()
+        if stage not in stages:
+            stages[stage] = [x_position, x_position]
+        stages[stage][1] = max(stages[stage][1], x_position)
+        if environment.get_lives() < lives:
+            deaths += 1
+        lives = environment.get_lives()
+    wall = time.perf_counter() - start_wall
+
+    if environment.get_game_over():
+        deaths += 1
+    else:
+        expert.end_episode()
+
+    progress = sum(furthest - first for first, furthest in stages.values())
+    total_cpu = cpu["planner"] + cpu["emulator"]
+    return {
+        "frames": environment.frames - first_frame,
+        "progress": progress,
+        "deaths": deaths,
+        "planner_cpu_s": cpu["planner"],
+        "emulator_cpu_s": cpu["emulator"],
+        "progress_per_cpu_s": progress / max(total_cpu, 1e-9),
+        "wall_s": wall,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns a message for every metric that is worse than the baseline"""
+    regressions = []
+    for start, metrics in results.items():
+        if start not in baseline:
+            logging.warning(f"{start} has no baseline")
+            continue
+        base = baseline[start]
+        for metric in HIGHER_BETTER:
+            if metrics[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{start}: {metric} dropped from {base[metric]:.1f} to {metrics[metric]:.1f}")
+        if metrics["deaths"] > base["deaths"]:
+            regressions.append(f"{start}: deaths went up from {base['deaths']} to {metrics['deaths']}")
+    return regressions
+
+
+def main():
+    args = get_args()
+
+    os.environ["MARIO_ROUTE_DB"] = args.routes
+
+    results = {}
+    with tempfile.TemporaryDirectory() as results_path:
+        expert = new_expert(results_path)
+        starts = args.starts or library_starts(expert.environment)
+        for i, start in enumerate(starts):
+            #a fresh agent for every start state so nothing planned in one carries over
+            if i > 0:
+                expert = new_expert(results_path)
+            results[start] = run_start(expert, start, args.frames)
+            expert.environment.pyboy.stop(save=False)
+            logging.info(f"{start}: {results[start]}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        logging.info(f"Saved baseline for {len(results)} start states to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        logging.warning(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        logging.error(regression)
+    if regressions:
+        raise SystemExit(1)
+    logging.info(f"No regressions across {len(results)} start states")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Regenerates the video, or a single frame, of a run from the button log written by MarioExpert.record (or MARIO_REPLAY).
+
+    python3 workspace.py --record
+    python3 replay.py ../results/your_upi/mario_expert.replay.npz --video mario_expert.mp4
+    python3 replay.py ../results/your_upi/mario_expert.replay.npz --frame 1200 --image frame.png
+"""
+
+import argparse
+import logging
+
+import cv2
+
+from mario_expert import MarioController, ReplayLog
+
+logging.basicConfig(level=logging.INFO)
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("replay", type=str)
+    parse_args.add_argument("--video", type=str, default=None)
+    parse_args.add_argument("--stride", type=int, default=10, help="frames between video frames, play() writes one per step")
+    parse_args.add_argument("--fps", type=int, default=30)
+    parse_args.add_argument("--frame", type=int, default=None, help="stop at this frame and save it to --image")
+    parse_args.add_argument("--image", type=str, default="frame.png")
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    masks, hashes, start = ReplayLog.load(args.replay)
+    logging.info(f"Replaying {len(masks)} frames with {len(hashes)} state hashes from {start or 'init.state'}")
+
+    environment = MarioController(headless=True)
+    environment.start_state = start
+    environment.reset()
+
+    video = None
+    if args.video is not None:
+        frame = environment.grab_frame()
+        height, width, _ = frame.shape
+        video = cv2.VideoWriter(args.video, cv2.VideoWriter_fourcc(*"mp4v"), args.fps, (width, height))
+        video.write(frame)
+
+    last = len(masks) if args.frame is None else min(args.frame, len(masks))
+    held = 0
+    mismatches = 0
+    for frame_number in range(1, last + 1):
+        mask = int(masks[frame_number - 1])
+        changed = held ^ mask
+        for button in range(len(environment.valid_actions)):
+            if changed >> button & 1:
+                if mask >> button & 1:
+                    environment.pyboy.send_input(environment.valid_actions[button])
+                else:
+                    environment.pyboy.send_input(environment.release_button[button])
+        held = mask
+        environment.pyboy.tick()
+
+        if frame_number in hashes and ReplayLog.state_hash(environment.pyboy) != hashes[frame_number]:
+            mismatches += 1
+            logging.warning(f"State hash mismatch at frame {frame_number}")
+
+        if video is not None and frame_number % args.stride == 0:
+            video.write(environment.grab_frame())
+
+    if video is not None:
+        video.release()
+        logging.info(f"Saved video to {args.video}")
+
+    if args.frame is not None:
+        cv2.imwrite(args.image, environment.grab_frame())
+        logging.info(f"Saved frame {last} to {args.image}")
+
+    logging.info(f"Replay finished at frame {last} with {mismatches} state hash mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Tails the live metrics published by runs started with MARIO_TELEMETRY set and prints the latest record of every run.
+
+    python3 telemetry_tail.py unix:/tmp/mario.sock
+    python3 telemetry_tail.py file:../results/upi_one/metrics.jsonl file:../results/upi_two/metrics.jsonl
+
+Any number of runs can send to the same socket, they are told apart by their run name.
+"""
+
+import argparse
+import json
+import logging
+import os
+import select
+import socket
+import time
+
+logging.basicConfig(level=logging.INFO)
+
+COLUMNS = ["run", "world", "stage", "x_position", "lives", "fps", "step_ms", "plan_ms", "frames"]
+
+
+class FileTail:
+    """Follows a metrics file across rotations, returning the lines appended since the last read"""
+
+    def __init__(self, path, from_start):
+        self.path = path
+        self.file = None
+        self.inode = None
+        #the start of a line whose newline hasn't been written yet
+        self.partial = ""
+        #a file that doesn't exist yet is read from its start once it shows up
+        self.from_start = from_start or not os.path.exists(path)
+
+    def open(self):
+        if not os.path.exists(self.path):
+            return
+        self.file = open(self.path, "r", encoding="utf-8")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if not self.from_start:
+            self.file.seek(0, os.SEEK_END)
+        #after a rotation the new file is read from its start
+        self.from_start = True
+
+    def read(self):
+        if self.file is None:
+            self.open()
+            if self.file is None:
+                return []
+
+        lines = self.complete(self.file.readlines())
+        if os.path.exists(self.path) and os.stat(self.path).st_ino != self.inode:
+            self.file.close()
+            #a rotated file is finished so anything left without a newline will never be completed
+            self.partial = ""
+            self.open()
+            lines += self.complete(self.file.readlines())
+        return lines
+
+    def complete(self, lines):
+        """Returns the whole lines, holding back a trailing line that is still being written until its newline arrives"""
+        if self.partial and lines:
+            lines[0] = self.partial + lines[0]
+            self.partial = ""
+        if lines and not lines[-1].endswith("\n"):
+            self.partial = lines.pop()
+        return lines
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("sources", type=str, nargs="+", help="unix:/path to listen on or file:/path to follow")
+    parse_args.add_argument("--refresh", type=float, default=2.0)
+    parse_args.add_argument("--from-start", action="store_true")
+
+    return parse_args.parse_args()
+
+
+def print_table(latest):
+    rows = [COLUMNS]
+    for run in sorted(latest):
+        record = latest[run]
+        row = []
+        for column in COLUMNS:
+            value = record.get(column, "")
+            row.append(f"{value:.1f}" if isinstance(value, float) else str(value))
+        if record.get("final"):
+            row[0] += " (done)"
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    print(time.strftime("%H:%M:%S"))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+    print()
+
+
+def main():
+    args = get_args()
+
+    sockets = []
+    tails = []
+    for source in args.sources:
+        kind, _, path = source.partition(":")
+        if kind == "unix":
+            if os.path.exists(path):
+                os.remove(path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            listener.bind(path)
+            sockets.append(listener)
+            logging.info(f"Listening on {path}")
+        elif kind == "file":
+            tails.append(FileTail(path, args.from_start))
+            logging.info(f"Following {path}")
+        else:
+            raise ValueError(f"Source must be unix:/path or file:/path not {source}")
+
+    latest = {}
+    next_print = time.perf_counter() + args.refresh
+    try:
+        while True:
+            lines = []
+            if sockets:
+                ready, _, _ = select.select(sockets, [], [], 0.2)
+                for listener in ready:
+                    lines.append(listener.recv(65536).decode("utf-8"))
+            else:
+                time.sleep(0.2)
+            for tail in tails:
+                lines += tail.read()
+
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                latest[record["run"]] = record
+
+            if time.perf_counter() >= next_print:
+                print_table(latest)
+                next_print += args.refresh
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for listener in sockets:
+            path = listener.getsockname()
+            listener.close()
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
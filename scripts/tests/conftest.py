@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+#the scripts import each other by module name, as run.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def played(tmp_path_factory):
+    """(game areas, origins) the expert saw playing a few tile-world seeds, the same kind of areas it plans on in the emulator"""
+    from mario_expert import MarioExpert
+    from tile_world import TileWorld
+
+    route_db = os.environ.get("MARIO_ROUTE_DB")
+    os.environ["MARIO_ROUTE_DB"] = ""
+    areas = []
+    origins = []
+    try:
+        for seed in range(4):
+            environment = TileWorld(seed=seed)
+            environment.reset()
+            expert = MarioExpert.from_environment(environment, str(tmp_path_factory.mktemp(f"seed{seed}")))
+            try:
+                while environment.frames < 1500 and not environment.get_game_over():
+                    expert.step()
+                    areas.append(expert.gamespace.copy())
+                    origins.append(expert.origin)
+            finally:
+                expert.close()
+    finally:
+        if route_db is None:
+            del os.environ["MARIO_ROUTE_DB"]
+        else:
+            os.environ["MARIO_ROUTE_DB"] = route_db
+    return np.array(areas), np.array(origins)
+
+
+@pytest.fixture
+def planner():
+    """An expert with only its planning state, no environment"""
+    from mario_expert import MarioExpert
+
+    expert = MarioExpert.__new__(MarioExpert)
+    expert.init_planning()
+    return expert
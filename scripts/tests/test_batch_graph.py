@@ -0,0 +1,35 @@
+import numpy as np
+
+from mario_expert import BatchGraph
+
+
+def graph_adjacency(expert):
+    """generate_graph's edges as a (320, 320) boolean adjacency like BatchGraph's"""
+    adjacency = np.zeros((320, 320), dtype=bool)
+    for (row, col), node in np.ndenumerate(expert.gamegraph.node_array):
+        if node is None:
+            continue
+        for edge in node.edge_list:
+            adjacency[row * 20 + col, edge.finish_row * 20 + edge.finish_col] = True
+    return adjacency
+
+
+def test_batch_graph_matches_generate_graph(played, planner):
+    areas, _ = played
+    batch = BatchGraph(areas)
+    for i, area in enumerate(areas):
+        planner.observe(area)
+        planner.generate_graph()
+        assert (batch.adjacency[i] == graph_adjacency(planner)).all(), i
+
+
+def test_batch_targets_match_plan_target(played, planner):
+    areas, _ = played
+    rows, cols = BatchGraph.mario_positions(areas)
+    targets = BatchGraph(areas).targets(rows, cols)
+    for i, area in enumerate(areas):
+        planner.observe(area)
+        assert (rows[i], cols[i]) == (planner.mario_row, planner.mario_col)
+        planner.generate_graph()
+        target = planner.plan_target()
+        assert targets[i] == (-1 if target is None else target), i
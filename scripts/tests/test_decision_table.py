@@ -0,0 +1,36 @@
+import random
+
+from mario_expert import LINK, MASK_BUTTONS, Edge, MarioController, RuleProbe, decision_index, decision_table
+
+
+def rule_mask(row, col, edge, enemy_row, enemy_col, on_ground, jump_phase):
+    probe = RuleProbe(on_ground, jump_phase)
+    if edge.link_type == LINK.WALK:
+        MarioController.walk(probe, col, edge, enemy_col)
+    elif edge.link_type == LINK.FALL:
+        MarioController.fall(probe, row, col, edge, enemy_col)
+    elif edge.link_type == LINK.JUMP:
+        MarioController.jump(probe, row, col, edge, enemy_row, enemy_col)
+    else:
+        MarioController.faith(probe, row, col, edge, enemy_row, enemy_col)
+    return probe.mask
+
+
+def table_mask(row, col, edge, enemy_row, enemy_col, on_ground, jump_phase):
+    probe = RuleProbe(on_ground, jump_phase)
+    probe.send_button(MASK_BUTTONS[decision_table()[decision_index(row, col, edge, enemy_row, enemy_col, on_ground, jump_phase)]])
+    return probe.mask
+
+
+def test_table_presses_what_the_rules_press():
+    rng = random.Random(0)
+    for _ in range(20000):
+        row, col = rng.randint(3, 15), rng.randint(0, 19)
+        edge = Edge(rng.randint(3, 15), rng.randint(0, 19), rng.choice(list(LINK)))
+        #a fifth with no enemy, the rest anywhere on screen
+        if rng.random() < 0.2:
+            enemy_row, enemy_col = -1, -1
+        else:
+            enemy_row, enemy_col = rng.randint(0, 15), rng.randint(0, 19)
+        situation = (row, col, edge, enemy_row, enemy_col, rng.randint(0, 1), rng.randint(0, 2))
+        assert table_mask(*situation) == rule_mask(*situation), situation
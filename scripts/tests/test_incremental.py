@@ -0,0 +1,31 @@
+from mario_expert import AnytimePlanner, IncrementalPlanner
+
+
+def path(route):
+    return [(edge.finish_row, edge.finish_col, edge.link_type) for edge in route]
+
+
+def test_incremental_matches_search_from_scratch(played, planner):
+    areas, origins = played
+    incremental = IncrementalPlanner()
+    scratch = IncrementalPlanner(incremental=False)
+    uniform = AnytimePlanner(budget_us=10 ** 9)
+    planned = 0
+    for step, (area, origin) in enumerate(zip(areas, origins)):
+        planner.observe(area)
+        planner.origin = int(origin)
+        planner.generate_graph()
+        target = planner.plan_target()
+        if target is None:
+            continue
+        planned += 1
+        args = (planner.gamegraph, planner.origin, planner.mario_row, planner.mario_col, target, planner.search_cost)
+        route = incremental.plan(*args)
+        assert path(route) == path(scratch.plan(*args)), step
+
+        #a uniform cost search may break ties differently but has to find the same cost
+        best = uniform.plan(planner.gamegraph, planner.mario_row, planner.mario_col, target, planner.search_cost, step)
+        assert abs(sum(map(planner.search_cost, route)) - sum(map(planner.search_cost, best))) < 1e-6, step
+
+    #enough plans on graphs that change a little every step for the repairs to have been exercised
+    assert planned >= 100
@@ -0,0 +1,392 @@
+"""
+A stand-in for the emulator that runs MarioExpert on synthetic tile levels with simplified physics and walking enemies, no ROM needed.
+
+    python3 tile_world.py --episodes 200 --workers 8
+    python3 tile_world.py --episodes 2000 --policy right
+
+TileWorld is a MarioController, so the agent's executor runs unchanged on top of it: send_button and release_all go through
+pyboy.send_input, tick through pyboy.tick, and the kinematic flags read by _read_m come from the simulated Mario.
+Levels are generated from (seed, world, stage) so every run of a seed sees the same terrain.
+
+Throughput on one core at the default 3000 frame budget: about 5 episodes/s (10k frames/s) with the agent and about 145k frames/s for the world alone
+(--policy right, 90 episodes/s as most of its episodes end early in a game over). Nine tenths of an agent step is MarioExpert building its graph and searching it,
+so the world isn't vectorised across episodes, it wouldn't make the agent's episodes faster. --workers runs batches of episodes in processes for more.
+
+Mario's physics here are JumpArcModel.DEFAULTS, so the arc model always matches this world exactly.
+That makes it fine for testing the agent and its speed, but checking an arc model (or the graph's jump links) against it is circular,
+calibrate against the emulator for that.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from mario_expert import ACTION, JumpArcModel, MarioController, MarioExpert
+
+logging.basicConfig(level=logging.INFO)
+
+#game area values, anything >= 10 is solid and >= 15 an enemy like the real mapping
+EMPTY = 0
+MARIO = 1
+GROUND = 10
+PIPE = 14
+ENEMY = 15
+
+ROWS = 16
+COLS = 20
+TILE = 8
+
+
+class TileMemory(dict):
+    """The few RAM addresses the agent reads, anything else reads as 0"""
+
+    def __missing__(self, key):
+        return 0
+
+
+def generate_level(seed, world, stage, width=200):
+    """Returns (terrain, enemy start columns) for a level of ground with gaps, pipes and floating bricks"""
+    rng = random.Random(seed * 1000 + world * 10 + stage)
+    terrain = np.zeros((ROWS, width), dtype=np.uint8)
+    terrain[14:, :] = GROUND
+    enemies = []
+
+    col = 16
+    while col < width - 16:
+        kind = rng.choice(["gap", "pipe", "bricks", "enemy", "flat"])
+        if kind == "gap":
+            terrain[14:, col:col + rng.randint(2, 3)] = EMPTY
+        elif kind == "pipe":
+            height = rng.randint(2, 3)
+            terrain[14 - height:14, col:col + 2] = PIPE
+        elif kind == "bricks":
+            terrain[rng.randint(9, 10), col:col + rng.randint(3, 5)] = GROUND
+        elif kind == "enemy":
+            enemies.append(col + 1)
+        col += rng.randint(6, 10)
+    return terrain, enemies
+
+
+class TileEmulator:
+    """
+    Simulates Mario, the enemies and the scrolling screen a frame at a time, standing in for the PyBoy object.
+
+    Mario is a 16x16 pixel box moved with the JumpArcModel parameters, so the jumps here are the ones the arc model expects and can't be used to validate it.
+    Walking enemies turn around at walls and ledges, landing on one from above removes it and touching it any other way is a death.
+
+    Args:
+        seed (int): Seed the levels are generated from.
+        lives (int): Lives at the start of a game, a death with none left is game over. Defaults to 2.
+        params (dict): Physics parameters, JumpArcModel.DEFAULTS if not given.
+    """
+
+    def __init__(self, seed: int, lives: int = 2, params: dict = None) -> None:
+        self.seed = seed
+        self.start_lives = lives
+        self.params = dict(JumpArcModel.DEFAULTS, **(params or {}))
+        self.memory = TileMemory()
+        #indices of the buttons held, in MarioController.valid_actions order
+        self.held = set()
+        self.events = {}
+        self.reset()
+
+    def reset(self, world=1, stage=1):
+        self.world = world
+        self.stage = stage
+        self.lives = self.start_lives
+        self.score = 0
+        self.game_over = False
+        self.start_stage()
+
+    def start_stage(self):
+        self.terrain, starts = generate_level(self.seed, self.world, self.stage)
+        self.width = self.terrain.shape[1]
+        self.enemies = [[float(col * TILE), 13, -0.5] for col in starts]
+        self.x = 3.0 * TILE
+        self.y = 12.0 * TILE
+        self.vy = 0.0
+        self.on_ground = True
+        self.rising = False
+        self.rise_frames = 0
+        self.jump_held = False
+        self.camera = 0
+        self.time = 400
+        self.frame = 0
+        self.update_memory()
+
+    def send_input(self, event):
+        button, pressed = self.events[event]
+        if pressed:
+            self.held.add(button)
+        else:
+            self.held.discard(button)
+
+    def solid(self, x0, y0, x1, y1) -> bool:
+        """Whether any solid tile overlaps the pixel box, the floor of the level is open and the sides are walls"""
+        for row in range(max(int(y0) // TILE, 0), min(int(y1) // TILE, ROWS - 1) + 1):
+            for col in range(int(x0) // TILE, int(x1) // TILE + 1):
+                if col < 0 or col >= self.width or self.terrain[row, col] >= GROUND:
+                    return True
+        return False
+
+    def tick(self):
+        if self.game_over:
+            return
+        self.frame += 1
+        params = self.params
+        right = ACTION.RIGHT.value in self.held
+        left = ACTION.LEFT.value in self.held
+        jump = ACTION.BUTT_A.value in self.held
+        speed = params["run_speed"] if ACTION.BUTT_B.value in self.held else params["walk_speed"]
+
+        #horizontal, blocked by walls and the left edge of the screen
+        dx = speed * (right - left) * (1.0 if self.on_ground else params["air_control"])
+        if dx and not self.solid(self.x + dx, self.y, self.x + dx + 15, self.y + 15):
+            self.x = max(self.x + dx, float(self.camera))
+
+        #vertical, a jump starts on a new press of A and keeps rising while it is held
+        if jump and not self.jump_held and self.on_ground:
+            self.rising = True
+            self.rise_frames = 0
+        self.jump_held = jump
+        if self.rising and (self.rise_frames < params["min_rise_frames"] or (jump and self.rise_frames < params["max_rise_frames"])):
+            self.vy = -params["rise_speed"]
+            self.rise_frames += 1
+        else:
+            self.rising = False
+            self.vy = min(self.vy + params["gravity"], params["terminal_speed"])
+
+        y = self.y + self.vy
+        if self.vy > 0 and self.solid(self.x, y, self.x + 15, y + 15):
+            self.y = (int(y + 15) // TILE) * TILE - 16.0
+            self.vy = 0.0
+            self.on_ground = True
+        elif self.vy < 0 and self.solid(self.x, y, self.x + 15, y + 15):
+            self.y = (int(y) // TILE + 1) * TILE
+            self.vy = 0.0
+            self.rising = False
+        else:
+            self.y = y
+            self.on_ground = self.vy >= 0 and self.solid(self.x, self.y + 16, self.x + 15, self.y + 16)
+
+        self.move_enemies()
+        self.camera = min(max(self.camera, int(self.x) - 9 * TILE), (self.width - COLS) * TILE)
+        if self.frame % 24 == 0:
+            self.time -= 1
+
+        if self.y > ROWS * TILE or self.time <= 0:
+            self.die()
+        elif self.x >= (self.width - 12) * TILE:
+            self.next_stage()
+        self.update_memory()
+
+    def move_enemies(self):
+        for enemy in list(self.enemies):
+            x, row, speed = enemy
+            ahead = x + speed + (7 if speed > 0 else 0)
+            col = int(ahead) // TILE
+            if col < 0 or col >= self.width or self.terrain[row, col] >= GROUND or self.terrain[row + 1, col] < GROUND:
+                enemy[2] = -speed
+            else:
+                enemy[0] = x + speed
+
+            #overlapping mario, from above is a stomp
+            if self.x < enemy[0] + 8 and enemy[0] < self.x + 16 and self.y < row * TILE + 8 and row * TILE < self.y + 16:
+                if self.vy > 0 and self.y + 16 - row * TILE <= 4:
+                    self.enemies.remove(enemy)
+                    self.vy = -self.params["rise_speed"]
+                    self.score += 100
+                else:
+                    self.die()
+                    return
+
+    def die(self):
+        if self.lives == 0:
+            self.game_over = True
+            return
+        self.lives -= 1
+        self.start_stage()
+
+    def next_stage(self):
+        self.score += self.time * 10
+        if self.stage == 3:
+            self.world += 1
+            self.stage = 1
+        else:
+            self.stage += 1
+        self.start_stage()
+
+    def update_memory(self):
+        memory = self.memory
+        memory[0xC201] = int(self.y) & 0xFF
+        memory[0xC20A] = 1 if self.on_ground else 0
+        memory[0xC207] = 0 if self.on_ground else (1 if self.vy < 0 else 2)
+        memory[0xDA15] = self.lives
+
+    def game_area(self) -> np.ndarray:
+        origin = self.camera // TILE
+        area = self.terrain[:, origin:origin + COLS].copy()
+        for x, row, _ in self.enemies:
+            col = int(x + 4) // TILE - origin
+            if 0 <= col < COLS:
+                area[row, col] = ENEMY
+        top = int(self.y) // TILE
+        left = int(self.x) // TILE - origin
+        for row in range(max(top, 0), min(top + 2 + (int(self.y) % TILE > 0), ROWS)):
+            for col in range(max(left, 0), min(left + 2 + (int(self.x) % TILE > 0), COLS)):
+                area[row, col] = MARIO
+        return area
+
+
+class TileScreen:
+    """Blank screen buffer so the frame accessors still work"""
+
+    def __init__(self) -> None:
+        self.ndarray = np.zeros((144, 160, 4), dtype=np.uint8)
+
+
+class TileWorld(MarioController):
+    """
+    MarioController over a TileEmulator instead of PyBoy, covering the parts of the MarioEnvironment surface the agent uses.
+
+    Args:
+        seed (int): Seed the levels are generated from. Defaults to 0.
+        act_freq (int): Frames every action is held for. Defaults to 10.
+        lives (int): Lives at the start of a game. Defaults to 2.
+    """
+
+    def __init__(self, seed: int = 0, act_freq: int = 10, lives: int = 2) -> None:
+        self.pyboy = TileEmulator(seed, lives=lives)
+        self.screen = TileScreen()
+        self.start_state = None
+        self.loaded_state = None
+        self.init_controls(act_freq)
+        for button, (press, release) in enumerate(zip(self.valid_actions, self.release_button)):
+            self.pyboy.events[press] = (button, True)
+            self.pyboy.events[release] = (button, False)
+
+    def reset(self, world: int = None, stage: int = None):
+        self.pyboy.reset(world or 1, stage or 1)
+        self.release_all()
+
+    def game_area(self) -> np.ndarray:
+        return self.pyboy.game_area()
+
+    def get_lives(self):
+        return self.pyboy.lives
+
+    def get_score(self):
+        return self.pyboy.score
+
+    def get_coins(self):
+        return 0
+
+    def get_stage(self):
+        return self.pyboy.stage
+
+    def get_world(self):
+        return self.pyboy.world
+
+    def get_time(self):
+        return self.pyboy.time
+
+    def get_game_over(self):
+        return self.pyboy.game_over
+
+    def get_dead_timer(self):
+        return 0
+
+    def get_dead_jump_timer(self):
+        return 0
+
+    def get_x_position(self):
+        #the right edge of mario like the real game, so x_position // 8 - mario's column is the screen origin
+        return int(self.pyboy.x) + 15
+
+
+def run_episode(seed, frames, policy):
+    """Plays one game on the levels of a seed for up to frames frames and returns how far it got"""
+    environment = TileWorld(seed=seed)
+    environment.reset()
+    expert = None
+    if policy == "expert":
+        expert = MarioExpert.from_environment(environment, tempfile.gettempdir())
+
+    furthest = (1, 1, 0)
+    deaths = 0
+    lives = environment.get_lives()
+    try:
+        while environment.frames < frames and not environment.get_game_over():
+            if expert is not None:
+                expert.step()
+            else:
+                #hold right and jump every other step
+                environment.release_all()
+                environment.send_button([ACTION.RIGHT.value] + ([ACTION.BUTT_A.value] if environment.frames // environment.act_freq % 2 else []))
+                environment.tick(environment.act_freq)
+            furthest = max(furthest, (environment.get_world(), environment.get_stage(), environment.get_x_position()))
+            deaths += environment.get_lives() < lives
+            lives = environment.get_lives()
+    finally:
+        #end_episode only runs on a game over, the frame budget ends most episodes
+        if expert is not None:
+            expert.close()
+
+    return {
+        "seed": seed,
+        "frames": environment.frames,
+        "world": furthest[0],
+        "stage": furthest[1],
+        "x_position": furthest[2],
+        "deaths": deaths + environment.get_game_over(),
+        "game_over": environment.get_game_over(),
+        "score": environment.get_score(),
+    }
+
+
+def run_batch(seeds, frames, policy):
+    #the route database would carry what one seed learnt over to the next
+    os.environ["MARIO_ROUTE_DB"] = ""
+    return [run_episode(seed, frames, policy) for seed in seeds]
+
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("--episodes", type=int, default=100)
+    parse_args.add_argument("--frames", type=int, default=3000, help="frame budget for each episode")
+    parse_args.add_argument("--seed", type=int, default=0, help="seed of the first episode, episode i uses seed + i")
+    parse_args.add_argument("--workers", type=int, default=1)
+    parse_args.add_argument("--policy", type=str, default="expert", choices=["expert", "right"], help="right only runs the world, for its raw speed")
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    seeds = list(range(args.seed, args.seed + args.episodes))
+    start = time.perf_counter()
+    if args.workers > 1:
+        batches = [seeds[i::args.workers] for i in range(args.workers)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = [result for batch in executor.map(run_batch, batches, [args.frames] * args.workers, [args.policy] * args.workers) for result in batch]
+    else:
+        results = run_batch(seeds, args.frames, args.policy)
+    elapsed = time.perf_counter() - start
+
+    frames = sum(result["frames"] for result in results)
+    stages = np.array([(result["world"] - 1) * 3 + result["stage"] for result in results])
+    logging.info(f"{len(results)} episodes in {elapsed:.2f} s, {len(results) / elapsed:.1f} episodes/s, {frames / elapsed:.0f} frames/s")
+    logging.info(f"Mean stages reached: {stages.mean():.2f}, mean x in the last stage: {np.mean([result['x_position'] for result in results]):.0f}")
+    logging.info(f"Deaths per episode: {np.mean([result['deaths'] for result in results]):.2f}, game overs: {sum(result['game_over'] for result in results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,38 @@
-from run import run
-from mario_environment import MarioEnvironment
-from mario_expert import * #allegedly bad practice go get fucked
-
 import argparse
-import logging
 import os
 from pathlib import Path
 
+from mario_expert import MarioExpert
+from run import run
+
 upi = "hmah689"
 headless = False
 
-run(upi,headless)
+
+def get_args():
+    parse_args = argparse.ArgumentParser()
+
+    parse_args.add_argument("--record", action="store_true", help="log the button inputs to mario_expert.replay.npz for replay.py instead of encoding mario_expert.mp4")
+    parse_args.add_argument("--headless", action="store_true")
+
+    return parse_args.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if args.record:
+        #same results directory run.py uses
+        results_path = f"{Path(__file__).parent.parent}/results/{upi}"
+        os.makedirs(results_path, exist_ok=True)
+        MarioExpert(results_path=results_path, headless=headless or args.headless).record()
+    else:
+        run(upi, headless or args.headless)
+
+
+#guarded so the spawned rollout and pipeline workers, which re-import the main script, don't start a run of their own
+if __name__ == "__main__":
+    main()
 
 # ##copied from run.py
 # if upi == "your_upi":